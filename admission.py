@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""Admission control for encodes
+
+At most `limit` encodes run at once (default: one per core) and at most
+`max_waiting` more may wait for a slot, in arrival order. Past that, admit()
+fails fast with Overloaded, which /generate turns into 429 + Retry-After.
+A waiting encode gives up with QueueTimeout once its deadline passes, and
+with Cancelled as soon as its cancelled() check says the client is gone. The
+check raises Withdrawn itself when the client called the encode off (DELETE
+/jobs/<id>), which is counted apart from clients that went away.
+
+    ticket = scheduler.admit()          # may raise Overloaded
+    with ticket.slot(cancelled=check):  # may raise QueueTimeout / Cancelled / Withdrawn
+        encode(...)
+
+A ticket holds its place until release(), even one that never got a slot:
+callers using wait() directly must release on every path, as slot() does.
+
+    python admission.py   # check every way out of the queue frees its place
+"""
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# Encodes running at once
+ENCODE_LIMIT = int(os.environ.get('ENCODE_LIMIT', os.cpu_count() or 1))
+
+# Encodes allowed to wait for a slot before requests are turned away
+ENCODE_QUEUE = int(os.environ.get('ENCODE_QUEUE', 2 * ENCODE_LIMIT))
+
+# Seconds an admitted encode may wait for a slot
+ENCODE_DEADLINE = float(os.environ.get('ENCODE_DEADLINE', 30))
+
+# How often waiters re-check their cancelled() callback
+CANCEL_POLL = 0.25
+
+
+class Overloaded(Exception):
+    """No room to run or queue another encode"""
+
+    def __init__(self, retry_after):
+        super().__init__('Too many videos are being generated; try again shortly')
+        self.retry_after = retry_after
+
+
+class QueueTimeout(Exception):
+    """An admitted encode waited past its deadline"""
+
+
+class Cancelled(Exception):
+    """The client went away before the encode finished"""
+
+
+class Withdrawn(Cancelled):
+    """The client cancelled the encode itself, e.g. with DELETE /jobs/<id>"""
+
+
+class Ticket:
+    """One admitted encode: waiting, then running, then released"""
+
+    def __init__(self, scheduler, deadline):
+        self.scheduler = scheduler
+        self.admitted = time.monotonic()
+        self.deadline = self.admitted + deadline
+        self.running = False
+        self.released = False
+
+    def wait(self, cancelled=None):
+        """Block until this ticket holds a slot"""
+        self.scheduler._wait(self, cancelled)
+
+    def release(self):
+        """Give the slot (or queue place) back; safe to call twice"""
+        self.scheduler._release(self)
+
+    def slot(self, cancelled=None):
+        """Context manager: wait for a slot, release it on exit"""
+        return _Slot(self, cancelled)
+
+
+class _Slot:
+    __slots__ = ('ticket', 'cancelled')
+
+    def __init__(self, ticket, cancelled):
+        self.ticket = ticket
+        self.cancelled = cancelled
+
+    def __enter__(self):
+        try:
+            self.ticket.wait(self.cancelled)
+        except BaseException:
+            self.ticket.release()
+            raise
+        return self.ticket
+
+    def __exit__(self, *exc):
+        self.ticket.release()
+        return False
+
+
+class EncodeScheduler:
+    """Concurrency limit plus a bounded FIFO wait queue with deadlines"""
+
+    def __init__(self, limit=ENCODE_LIMIT, max_waiting=ENCODE_QUEUE, deadline=ENCODE_DEADLINE,
+                 on_wait=None):
+        self.limit = max(1, limit)
+        self.max_waiting = max(0, max_waiting)
+        self.deadline = deadline
+        self.on_wait = on_wait  # called with each granted ticket's wait, in seconds
+        self._cond = threading.Condition()
+        self._queue = deque()   # tickets waiting for a slot, oldest first
+        self._admitted = 0      # tickets not yet released
+        self._running = 0
+        self._counts = {'admitted': 0, 'rejected': 0, 'timed_out': 0, 'cancelled': 0,
+                        'withdrawn': 0}
+        self._encode_seconds = 1.0  # moving average of slot hold times
+
+    @property
+    def capacity(self):
+        """Most tickets that can be outstanding at once"""
+        return self.limit + self.max_waiting
+
+    def admit(self, deadline=None):
+        """Take a place in line, or raise Overloaded if there is none"""
+        with self._cond:
+            if self._admitted >= self.capacity:
+                self._counts['rejected'] += 1
+                raise Overloaded(self._retry_after())
+            self._admitted += 1
+            self._counts['admitted'] += 1
+        return Ticket(self, self.deadline if deadline is None else deadline)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counts)
+            stats['running'] = self._running
+            stats['waiting'] = self._admitted - self._running
+            stats['limit'] = self.limit
+            stats['max_waiting'] = self.max_waiting
+            return stats
+
+    def _retry_after(self):
+        """Seconds until a place is likely to free up; caller holds the lock"""
+        waiting = self._admitted - self._running
+        return max(1, math.ceil(self._encode_seconds * (waiting + 1) / self.limit))
+
+    def _wait(self, ticket, cancelled):
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    if self._queue[0] is ticket and self._running < self.limit:
+                        self._queue.popleft()
+                        self._running += 1
+                        ticket.running = True
+                        ticket.started = time.monotonic()
+                        break
+                    try:
+                        gone = cancelled is not None and cancelled()
+                    except Withdrawn:
+                        self._counts['withdrawn'] += 1
+                        raise
+                    if gone:
+                        self._counts['cancelled'] += 1
+                        raise Cancelled('Client went away while waiting for an encoder')
+                    remaining = ticket.deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counts['timed_out'] += 1
+                        raise QueueTimeout('Timed out waiting for an encoder; try again later')
+                    self._cond.wait(min(remaining, CANCEL_POLL))
+            except BaseException:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()  # the next in line may be first now
+                raise
+        if self.on_wait:
+            self.on_wait(ticket.started - ticket.admitted)
+
+    def _release(self, ticket):
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._admitted -= 1
+            if ticket.running:
+                self._running -= 1
+                held = time.monotonic() - ticket.started
+                self._encode_seconds += 0.2 * (held - self._encode_seconds)
+            self._cond.notify_all()
+
+
+def main():
+    scheduler = EncodeScheduler(limit=1, max_waiting=2, deadline=0.3)
+    failures = 0
+
+    def expect(label, waiting, running, **counts):
+        nonlocal failures
+        stats = scheduler.stats()
+        ok = (stats['waiting'] == waiting and stats['running'] == running
+              and all(stats[key] == value for key, value in counts.items()))
+        failures += not ok
+        print(f"{label:<38} waiting {stats['waiting']} running {stats['running']}"
+              f"{'' if ok else f'  FAILED (expected {waiting}/{running} {counts})'}")
+
+    holder = scheduler.admit()
+    holder.wait()
+
+    # Both waiters time out behind the holder: wait() + release(), as /stream
+    # does, and slot()
+    ticket = scheduler.admit()
+    try:
+        ticket.wait()
+    except QueueTimeout:
+        ticket.release()
+    try:
+        with scheduler.admit().slot():
+            pass
+    except QueueTimeout:
+        pass
+    expect('after two queue timeouts', 0, 1)
+
+    try:
+        with scheduler.admit().slot(cancelled=lambda: True):
+            pass
+    except Cancelled:
+        pass
+    expect('after a cancelled waiter', 0, 1, cancelled=1, withdrawn=0)
+
+    def withdraw():
+        raise Withdrawn('Cancelled by the client')
+
+    try:
+        with scheduler.admit().slot(cancelled=withdraw):
+            pass
+    except Withdrawn:
+        pass
+    expect('after a withdrawn waiter', 0, 1, cancelled=1, withdrawn=1)
+
+    holder.release()
+    expect('after the slot is freed', 0, 0)
+
+    try:
+        with scheduler.admit().slot():
+            raise ValueError('encode failed')
+    except ValueError:
+        pass
+    expect('after an encode that raised', 0, 0)
+
+    # The full capacity is available again
+    tickets = [scheduler.admit() for _ in range(scheduler.capacity)]
+    for ticket in tickets:
+        ticket.release()
+    expect('after admitting the full capacity', 0, 0)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,112 @@
 #!/usr/bin/env python3
-from flask import Flask, render_template, jsonify, send_file, request
-import random
+from flask import Flask, render_template, jsonify, request, Response
 import subprocess
 import os
-import tempfile
-import json
-from PIL import Image, ImageDraw, ImageFont
+import threading
+import time
 import uuid
+from segment_cache import SegmentCache
+from video_encoder import stream_fragmented
+from jobs import Job, JobQueue, JOB_TTL
+from render_pool import RenderPool
+from video_store import VideoStore
+from video_serving import video_response
+from encoders import ENCODERS, VIDEO_FORMAT, get_encoder, mimetype_for
+from video_pool import VideoPool
+from admission import EncodeScheduler, Overloaded, QueueTimeout
+import metrics
+from plan import COMPLETION_LINE, FRAME_SECONDS, PLAN_MAX_STEPS, new_plan, template_lines
+
+# Nothing that renders (PIL, fonts, the frame atlas, PyAV) is imported here:
+# plan-only requests never need it. It loads on the first render, or up
+# front in warm(), which gunicorn.conf.py runs in the master before forking.
 
 app = Flask(__name__)
 
-def generate_random_string(length):
-    """Generate a random string of digits"""
-    return ''.join([str(random.randint(0, 9)) for _ in range(length)])
+# Frame layout: 800x600, 48px lines from y=100, 20px apart
+FRAME_LAYOUT = {'width': 800, 'height': 600, 'font_size': 48, 'top': 100, 'line_gap': 20}
+
+# Every step line pre-rendered once per process; frames are stacked from these
+_atlas = None
+_atlas_lock = threading.Lock()
+
+def get_atlas():
+    """The frame atlas, built (fonts loaded, lines rendered) on first use"""
+    global _atlas
+    if _atlas is None:
+        with _atlas_lock:
+            if _atlas is None:
+                from frame_atlas import FrameAtlas
+                _atlas = FrameAtlas(**FRAME_LAYOUT).preload(template_lines(COMPLETION_LINE))
+    return _atlas
+
+def render_frame(text):
+    return get_atlas().render(text)
+
+# Pre-encoded per-frame segments, used once `segment_cache.py build` has run
+segments = SegmentCache(render_frame)
+
+# Encodes running at once (ENCODE_LIMIT) and waiting (ENCODE_QUEUE); past
+# that /generate answers 429 instead of piling up work
+scheduler = EncodeScheduler(on_wait=metrics.QUEUE_WAIT.observe)
+metrics.registry.gauge('password_encodes', 'Admitted encodes, by state',
+                       lambda: {key: scheduler.stats()[key] for key in ('running', 'waiting')},
+                       label='state')
+metrics.registry.gauge('password_encode_admissions_total', 'Encode admission outcomes',
+                       lambda: {key: scheduler.stats()[key]
+                                for key in ('admitted', 'rejected', 'timed_out', 'cancelled',
+                                            'withdrawn')},
+                       label='outcome', kind='counter')
+
+# Generation runs on a bounded worker pool; /generate only enqueues. One
+# thread per admitted encode, so waiting happens in the scheduler's queue,
+# where deadlines and cancellation apply
+jobs = JobQueue(max_workers=scheduler.capacity)
+metrics.registry.gauge('password_jobs', 'Generation jobs held for polling, by status',
+                       jobs.stats, label='status')
+
+# Finished videos, bounded by size (LRU) and age (TTL); served from /videos/<id>
+video_store = VideoStore()
+metrics.registry.gauge('password_store_bytes', 'Bytes of video in the store',
+                       lambda: video_store.stats()['bytes'])
+metrics.registry.gauge('password_store_videos', 'Videos in the store',
+                       lambda: video_store.stats()['videos'])
+metrics.registry.gauge('password_store_evictions_total', 'Videos evicted from the store, by reason',
+                       lambda: video_store.stats()['evictions'], label='reason', kind='counter')
+metrics.registry.gauge('password_store_evicted_bytes_total', 'Bytes evicted from the store',
+                       lambda: video_store.stats()['evicted_bytes'], kind='counter')
+
+# Media type a client can Accept to get the step plan instead of a video
+PLAN_MIMETYPE = 'application/vnd.password-plan+json'
+
+# What the browser player needs to draw frames the way create_text_image does
+PLAN_LAYOUT = {
+    'width': FRAME_LAYOUT['width'],
+    'height': FRAME_LAYOUT['height'],
+    'font_size': FRAME_LAYOUT['font_size'],
+    'top': FRAME_LAYOUT['top'],
+    'line_height': FRAME_LAYOUT['font_size'] + FRAME_LAYOUT['line_gap'],
+    'frame_seconds': FRAME_SECONDS,
+    'completion_line': COMPLETION_LINE
+}
+
+# Plans waiting to be streamed from /stream/<id>: id -> (created, steps)
+streams = {}
+streams_lock = threading.Lock()
+
+# Optional warm process pool (RENDER_PROCESSES) for encoding chunks in parallel
+render_pool = RenderPool(layout=FRAME_LAYOUT, warm_lines=template_lines(COMPLETION_LINE))
 
 def create_text_image(text, width=800, height=600, font_size=48):
     """Create an image with text"""
+    from PIL import Image
+    from font_cache import registry as fonts
+    
     # Create a black background
     img = Image.new('RGB', (width, height), color='black')
-    draw = ImageDraw.Draw(img)
-    
-    # Try to use a default font, fallback to basic if not available
-    try:
-        font = ImageFont.truetype("/System/Library/Fonts/Monaco.ttf", font_size)
-    except:
-        try:
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf", font_size)
-        except:
-            font = ImageFont.load_default()
     
-    # Split text into lines and draw them
+    # Split text into lines and draw them; fonts and line bitmaps come from
+    # the per-worker cache instead of being loaded for every frame
     lines = text.split('\n')
     y_offset = 100
     line_height = font_size + 20
@@ -37,178 +114,342 @@ def create_text_image(text, width=800, height=600, font_size=48):
     for line in lines:
         if line.strip():  # Only draw non-empty lines
             # Center the text horizontally
-            bbox = draw.textbbox((0, 0), line, font=font)
-            text_width = bbox[2] - bbox[0]
+            text_width = fonts.text_width(line, font_size)
             x = (width - text_width) // 2
             
-            draw.text((x, y_offset), line, fill='white', font=font)
+            fonts.draw_text(img, (x, y_offset), line, font_size, fill='white')
             y_offset += line_height
     
     return img
 
 def generate_password_steps():
     """Generate password steps and return the data"""
-    # Generate a long random string (10-15 digits)
-    string_length = random.randint(10, 15)
-    random_string = generate_random_string(string_length)
-    
-    # Pick 4 target digits from the string
-    target_indices = []
-    
-    # 1st digit: random position in first 2/3
-    first_max = string_length - 6
-    target_indices.append(random.randint(0, first_max))
-    
-    # 2nd digit: after 1st digit
-    second_min = target_indices[0] + 1
-    second_max = string_length - 4
-    target_indices.append(random.randint(second_min, second_max))
-    
-    # 3rd digit: 2nd to last position
-    target_indices.append(string_length - 2)
+    plan = new_plan(max_steps=PLAN_MAX_STEPS)
+    return {
+        'target_password': plan.target_password,
+        'steps': plan.steps(COMPLETION_LINE),
+        'random_string': plan.random_string,
+        'target_indices': plan.target_indices
+    }
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+def run_generate_job(job, encoder, ticket):
+    """Generate password and create video for a queued job
     
-    # 4th digit: last position
-    target_indices.append(string_length - 1)
+    The encode waits for a slot on the admitted ticket first, and gives up
+    if the job is cancelled or its client stops polling.
+    """
+    timings = job.timings
     
-    # Create target password
-    target_password = ''.join([random_string[i] for i in target_indices])
+    # Everything after admission runs inside slot(), which releases the
+    # ticket however it exits (planning can fail too, e.g. PLAN_MAX_STEPS)
+    with ticket.slot(cancelled=job.cancelled):
+        # Generate password data
+        with timings.stage('plan'):
+            data = generate_password_steps()
+        
+        video_path = video_store.reserve(job.id, encoder.extension)
+        encode_job(job, encoder, data, video_path)
     
-    # Generate steps
-    steps = []
-    digits_on_screen = 0
-    total_digits_typed = 0
-    correct_digits_typed = 0
-    step = 1
+    timings.observe()
+    metrics.FRAMES_PER_VIDEO.observe(len(data['steps']))
+    metrics.BYTES_WRITTEN.inc(amount=video_store.add(job.id, encoder.extension))
     
-    while correct_digits_typed < 4:
-        # Check if the next digit to type is a target digit
-        next_target_index = target_indices[correct_digits_typed]
-        
-        # Prevent entering 4th digit unless we're at the last position
-        if digits_on_screen == 3 and total_digits_typed < string_length - 1:
-            digits_to_type = 0  # Don't enter 4th digit unless at the end
-        # If we're at a target digit position
-        elif total_digits_typed == target_indices[correct_digits_typed]:
-            # Check if this target digit will be placed in the correct position (rightmost)
-            if correct_digits_typed == digits_on_screen:
-                # Target digit will be placed in the right spot
-                digits_to_type = 1
-                correct_digits_typed += 1
-            else:
-                # Target digit would be placed in wrong spot, skip for now
-                digits_to_type = 0
+    return {
+        'password': data['target_password'],
+        'video_url': f'/videos/{job.id}',
+        'format': encoder.name,
+        'mimetype': encoder.mimetype
+    }
+
+def encode_job(job, encoder, data, video_path):
+    """Render and encode a job's frames into video_path"""
+    timings = job.timings
+    try:
+        if encoder.name == 'mp4' and segments.available():
+            # Stitch pre-encoded segments together; nothing is re-encoded
+            job.start(len(data['steps']), status='encoding')
+            with timings.stage('encode'):
+                segments.concat(data['steps'], video_path)
+        elif encoder.name == 'mp4' and render_pool.enabled:
+            # Render and encode chunks of the video in parallel processes
+            job.start(len(data['steps']))
+            with timings.stage('encode'):
+                render_pool.encode(data['steps'], video_path, progress=job.advance)
         else:
-            # Not at a target digit, randomly decide to insert or not
-            if random.random() < 0.5:
-                digits_to_type = 1
-            else:
-                digits_to_type = 0
-
-        # Get the digit to type
-        digit_to_enter = random_string[total_digits_typed]
-        
-        if digits_to_type > 0:
-            step_text = f"--- Step {step} ---\n"
-            step_text += f"Enter this digit: {digit_to_enter}\n"
-            digits_on_screen += digits_to_type
-            total_digits_typed += digits_to_type
-            step_text += f"Digits on screen: {digits_on_screen}"
-            steps.append(step_text)
-            step += 1
-
-        # Deletion logic: only delete if we have non-target digits on screen
-        if correct_digits_typed < digits_on_screen:
-            if random.random() < 0.5:
-                step_text = f"--- Step {step} ---\n"
-                step_text += "Delete 1 digit from the right\n"
-                digits_on_screen -= 1
-                step_text += f"Digits on screen: {digits_on_screen}"
-                steps.append(step_text)
-                step += 1
-    
-    steps.append("=" * 40 + "\n🎉 PASSWORD COMPLETE!")
+            # Hand frames to the encoder as they are rendered (ffmpeg pipe,
+            # PyAV or Pillow), writing straight into the store for serving
+            job.start(len(data['steps']))
+            encoder.encode(data['steps'], video_path, get_atlas(),
+                           progress=job.advance, timings=timings)
+    except subprocess.CalledProcessError:
+        metrics.ENCODER_FAILURES.inc('error')
+        raise RuntimeError('Failed to create video. Make sure ffmpeg is installed.')
+    except OSError:
+        metrics.ENCODER_FAILURES.inc('error')
+        raise
+
+def produce_pooled():
+    """Make one pool entry through the normal generate/render/encode path
     
+    Raises Overloaded while requests are using every slot, so the producer
+    backs off instead of competing with them.
+    """
+    job = Job()
+    encoder = get_encoder()
+    result = run_generate_job(job, encoder, scheduler.admit())
     return {
-        'target_password': target_password,
-        'steps': steps,
-        'random_string': random_string,
-        'target_indices': target_indices
+        'result': result,
+        'frames': job.frames_total,
+        'video_id': job.id,
+        'extension': encoder.extension
     }
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+def accept_pooled(entry):
+    """Restart a pooled video's TTL as it is handed out; False if evicted"""
+    try:
+        video_store.add(entry['video_id'], entry['extension'])
+    except FileNotFoundError:
+        return False
+    return True
+
+# Ready-made videos in the default format (VIDEO_POOL_HIGH > 0 enables it);
+# its producer thread is started per process by start_background()
+video_pool = VideoPool(produce_pooled, accept=accept_pooled)
+metrics.registry.gauge('password_pool_depth', 'Pre-generated videos ready to serve',
+                       video_pool.depth)
+metrics.registry.gauge('password_pool_requests_total', 'Pool lookups by /generate, by result',
+                       lambda: {key: video_pool.stats()[key] for key in ('hits', 'misses', 'stale')},
+                       label='result', kind='counter')
+metrics.registry.gauge('password_pool_produced_total', 'Videos made by the pool producer',
+                       lambda: video_pool.stats()['produced'], kind='counter')
+metrics.registry.gauge('password_pool_refill_rate', 'Videos the producer makes per second of work',
+                       lambda: video_pool.stats()['refill_rate'])
+
+def pooled_response(encoder):
+    """Answer /generate from the pool, or None on a miss"""
+    if encoder.name != VIDEO_FORMAT.lower():
+        return None
+    entry = video_pool.take()
+    if entry is None:
+        return None
+    job = jobs.add_finished(entry['result'], entry['frames'])
+    response = jsonify(dict(entry['result'],
+        success=True,
+        job_id=job.id,
+        status_url=f'/jobs/{job.id}',
+        status='done'
+    ))
+    response.headers['Server-Timing'] = 'pool;desc="hit"'
+    return response
+
+def wants_plan(options):
+    """Whether /generate should answer with the plan alone (no video)"""
+    if options.get('mode') == 'plan' or request.args.get('mode') == 'plan':
+        return True
+    # Listed second so */* and plain JSON clients keep getting a video job
+    best = request.accept_mimetypes.best_match(['application/json', PLAN_MIMETYPE])
+    return best == PLAN_MIMETYPE
+
+def overloaded_response(error, status=429):
+    """Tell the client to back off and when to retry"""
+    response = jsonify({
+        'success': False,
+        'error': str(error)
+    })
+    response.headers['Retry-After'] = str(getattr(error, 'retry_after', 1))
+    return response, status
+
+def plan_response():
+    """The step plan as compact JSON for the browser player
+
+    Steps are op codes (-1 = delete, otherwise the digit entered) with the
+    digits on screen after each; no PIL or ffmpeg work is done.
+    """
+    plan = new_plan(max_steps=PLAN_MAX_STEPS).to_dict()
+    plan['success'] = True
+    plan['layout'] = PLAN_LAYOUT
+    response = jsonify(plan)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+def start_stream():
+    """Generate a password now; its video is encoded when /stream/<id> is read"""
+    data = generate_password_steps()
+    stream_id = str(uuid.uuid4())
+    now = time.time()
+    with streams_lock:
+        for expired in [key for key, (created, _) in streams.items() if now - created > JOB_TTL]:
+            del streams[expired]
+        streams[stream_id] = (now, data['steps'])
+    return jsonify({
+        'success': True,
+        'password': data['target_password'],
+        'stream_url': f'/stream/{stream_id}'
+    })
 
 @app.route('/generate', methods=['POST'])
 def generate_password():
-    """Generate password and create video"""
+    """Queue password and video generation; poll /jobs/<id> for the result
+
+    With {"stream": true} (or ?stream=1) the password is returned at once
+    with a stream_url that plays the video while it is being encoded. With
+    {"mode": "plan"}, ?mode=plan or Accept: application/vnd.password-plan+json
+    only the step plan is returned, for the browser to play on a canvas.
+    {"format": "webp"} (or ?format=) picks the output encoder: mp4, webp,
+    apng or gif; the default comes from VIDEO_FORMAT. Default-format
+    requests are answered straight from the video pool when it has one ready.
+    When every encode slot and queue place is taken the answer is 429 with
+    Retry-After; a job nobody polls for JOB_ABANDON_AFTER seconds is cancelled.
+    """
+    options = request.get_json(silent=True) or {}
+    if wants_plan(options):
+        return plan_response()
+    if options.get('stream') or request.args.get('stream') == '1':
+        return start_stream()
     try:
-        # Generate password data
-        data = generate_password_steps()
-        
-        # Create temporary directory for this session
-        session_id = str(uuid.uuid4())
-        temp_dir = tempfile.mkdtemp(prefix=f"password_gen_{session_id}_")
-        
-        # Create images for each step
-        image_files = []
-        for i, step_text in enumerate(data['steps']):
-            img = create_text_image(step_text)
-            filename = os.path.join(temp_dir, f"frame_{i:03d}.png")
-            img.save(filename)
-            image_files.append(filename)
+        encoder = get_encoder(options.get('format') or request.args.get('format'))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    response = pooled_response(encoder)
+    if response is not None:
+        return response
+    try:
+        ticket = scheduler.admit()
+    except Overloaded as e:
+        return overloaded_response(e)
+    try:
+        start = time.perf_counter()
+        job = jobs.submit(lambda job: run_generate_job(job, encoder, ticket))
+        response = jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status_url': f'/jobs/{job.id}'
+        })
+        # The work happens later; its breakdown is on the finished /jobs/<id>
+        response.headers['Server-Timing'] = f'enqueue;dur={(time.perf_counter() - start) * 1000:.1f}'
+        return response, 202
         
-        # Create video using ffmpeg
-        video_filename = os.path.join(temp_dir, "password_demo.mp4")
-        try:
-            cmd = [
-                'ffmpeg', '-y',  # -y to overwrite output file
-                '-framerate', '1/10',  # 1 frame per 10 seconds
-                '-i', os.path.join(temp_dir, 'frame_%03d.png'),  # Input pattern
-                '-c:v', 'libx264',  # Video codec
-                '-pix_fmt', 'yuv420p',  # Pixel format for compatibility
-                video_filename  # Output file
-            ]
-            
-            subprocess.run(cmd, check=True, capture_output=True)
-            
-            # Move video to static directory for serving
-            static_video_path = os.path.join('static', f'password_demo_{session_id}.mp4')
-            os.makedirs('static', exist_ok=True)
-            os.rename(video_filename, static_video_path)
-            
-            # Clean up temporary directory
-            for filename in image_files:
-                os.remove(filename)
-            os.rmdir(temp_dir)
-            
-            return jsonify({
-                'success': True,
-                'password': data['target_password'],
-                'video_url': f'/static/password_demo_{session_id}.mp4'
-            })
-            
-        except subprocess.CalledProcessError as e:
-            # Clean up on error
-            for filename in image_files:
-                if os.path.exists(filename):
-                    os.remove(filename)
-            if os.path.exists(temp_dir):
-                os.rmdir(temp_dir)
-            
-            return jsonify({
-                'success': False,
-                'error': 'Failed to create video. Make sure ffmpeg is installed.'
-            }), 500
-            
     except Exception as e:
+        ticket.release()
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """Report queued/rendering/encoding/done/failed with frame progress
+    
+    Polling keeps the job alive; DELETE cancels it (its encode stops at the
+    next frame, or it leaves the queue).
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Unknown or expired job'
+        }), 404
+    
+    if request.method == 'DELETE':
+        job.cancel()
+    else:
+        job.seen()
+    status = job.to_dict()
+    status['success'] = status['status'] not in ('failed', 'cancelled')
+    response = jsonify(status)
+    if status['status'] == 'done':
+        # Per-stage breakdown of the finished job (plan, render, encode, ...)
+        response.headers['Server-Timing'] = job.timings.header()
+    return response
+
+@app.route('/stream/<stream_id>')
+def stream(stream_id):
+    """Fragmented MP4 straight from ffmpeg's stdout, sent as it is encoded
+    
+    The encode holds a slot until the response closes; a client that hangs
+    up closes it early, which stops ffmpeg.
+    """
+    with streams_lock:
+        entry = streams.get(stream_id)
+    if entry is None:
+        return jsonify({
+            'success': False,
+            'error': 'Unknown or expired stream'
+        }), 404
+    try:
+        ticket = scheduler.admit()
+    except Overloaded as e:
+        return overloaded_response(e)
+    try:
+        ticket.wait()
+        response = Response(stream_fragmented(entry[1], get_atlas()), mimetype='video/mp4', headers={
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'  # don't let a proxy hold fragments back
+        })
+    except QueueTimeout as e:
+        # A ticket keeps its place in line until released, slot or not
+        ticket.release()
+        return overloaded_response(e, 503)
+    except BaseException:
+        ticket.release()
+        raise
+    response.call_on_close(ticket.release)
+    return response
+
+@app.route('/videos/<video_id>')
+def video(video_id):
+    """Serve a generated video (or animated image) from the store
+    
+    Supports Range (206) and conditional GETs against a strong ETag; the
+    file is sent with sendfile, or by the proxy (see video_serving.py).
+    """
+    path = video_store.get(video_id)
+    if path is not None:
+        try:
+            return video_response(request.environ, request.headers, video_id, path,
+                                  mimetype_for(path))
+        except FileNotFoundError:
+            pass  # evicted since the lookup
+    return jsonify({
+        'success': False,
+        'error': 'Unknown or expired video'
+    }), 404
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text-format metrics for this worker"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+def warm():
+    """Pay every one-off start-up cost now instead of on the first requests
+    
+    Loads PIL and the fonts, renders the atlas's template lines, probes the
+    encoders (PyAV, ffmpeg, Pillow features) and compiles the page template.
+    Starts no threads, so it is safe to run before forking workers.
+    """
+    get_atlas()
+    for encoder in ENCODERS.values():
+        encoder.available()
+    app.jinja_env.get_template('index.html')
+
+def start_background():
+    """Start this process's background threads (the video pool producer)
+    
+    Threads don't survive fork, so with gunicorn this runs in each worker.
+    """
+    video_pool.start()
+
 if __name__ == '__main__':
     import os
+    warm()
+    start_background()
     port = int(os.environ.get('PORT', 8080))
     debug = os.environ.get('FLASK_ENV') != 'production'
     app.run(debug=debug, host='0.0.0.0', port=port)
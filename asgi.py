@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""asyncio entry point: most of application.py's routes, as an ASGI app
+
+One event loop holds every request while it waits, so a single process can
+keep hundreds of /generate calls in flight; threads are only borrowed for
+CPU work. Encodes are capped separately from requests:
+
+* at most ASYNC_ENCODE_LIMIT encodes run at once (default ENCODE_LIMIT, one
+  per core); the rest wait on a semaphore without holding a thread
+* at most ASYNC_MAX_IN_FLIGHT /generate requests are held at all; past that
+  they are answered 429 with Retry-After
+* MP4s are encoded by an ffmpeg started with asyncio.create_subprocess_exec,
+  fed gray8 frames rendered in the default thread pool; a client that hangs
+  up cancels its encode, which kills ffmpeg
+* the other formats (and MP4s when MP4_BACKEND resolves to PyAV, or without
+  an ffmpeg binary) run the encoder in the thread pool, as the WSGI app does
+
+/generate answers once the video is ready, with the same fields as a
+finished job, and /jobs/<id> reports it as done, so the page works unchanged.
+The plan mode, /videos/<id> and /metrics behave as in application.py, whose
+atlas, store and metrics are shared. Not implemented here: /stream/<id> (so
+/generate's stream option is ignored) and DELETE /jobs/<id>; a client cancels
+an encode by hanging up instead.
+
+No framework is needed; run it under any ASGI server, e.g.
+`pip install uvicorn`, then:
+
+    uvicorn asgi:app --port 8080
+    python asgi.py               # the same, if uvicorn is installed
+"""
+import asyncio
+import functools
+import json
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import application as wsgi
+import metrics
+import video_serving
+from admission import ENCODE_LIMIT
+from encoders import get_encoder, mimetype_for
+from jobs import JOB_TTL
+from metrics import Timings
+from plan import PLAN_MAX_STEPS, new_plan
+from video_encoder import pipe_command
+
+# Encodes running at once in this process
+ASYNC_ENCODE_LIMIT = int(os.environ.get('ASYNC_ENCODE_LIMIT', ENCODE_LIMIT))
+
+# /generate requests held at once (waiting or encoding) before answering 429
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get('ASYNC_MAX_IN_FLIGHT', 512))
+
+# Seconds a client turned away with 429 is asked to wait
+ASYNC_RETRY_AFTER = 1
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'index.html')
+
+# Created on first use, inside the server's event loop
+_encode_slots = None
+
+# Requests held by /generate, and encodes holding a slot
+_in_flight = 0
+_encoding = 0
+
+# Finished videos by id -> (created, result), for /jobs/<id>
+_results = {}
+
+_page = None
+
+metrics.registry.gauge('password_async_requests', 'Generate requests held by the asyncio app, by state',
+                       lambda: {'in_flight': _in_flight, 'encoding': _encoding}, label='state')
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_path():
+    return shutil.which('ffmpeg')
+
+
+def encode_slots():
+    global _encode_slots
+    if _encode_slots is None:
+        _encode_slots = asyncio.Semaphore(max(1, ASYNC_ENCODE_LIMIT))
+    return _encode_slots
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionResetError('Client went away')
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def wait_disconnect(receive):
+    """Return once the client hangs up"""
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def respond(send, status, body, content_type='application/json', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()),
+                    (b'content-length', str(len(body)).encode())]
+                   + [(name.lower().encode(), value.encode()) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def respond_json(send, data, status=200, headers=()):
+    return respond(send, status, json.dumps(data).encode(), headers=headers)
+
+
+def error(send, message, status, headers=()):
+    return respond_json(send, {'success': False, 'error': message}, status, headers)
+
+
+def wants_plan(options, query, headers):
+    """Whether /generate should answer with the plan alone (as in application.py)"""
+    if options.get('mode') == 'plan' or query.get('mode') == 'plan':
+        return True
+    accept = parse_accept_header(headers.get('accept', ''), MIMEAccept)
+    return accept.best_match(['application/json', wsgi.PLAN_MIMETYPE]) == wsgi.PLAN_MIMETYPE
+
+
+async def encode_ffmpeg(texts, output, atlas, timings):
+    """encode_pipe on the event loop: frames rendered in the thread pool are
+    written to ffmpeg's stdin without blocking; cancelling kills ffmpeg
+
+    ffmpeg writes output + '.part', which replaces output only once it exits
+    cleanly, as in video_encoder.encode_video, so a process killed mid-encode
+    never leaves a truncated video where the store would index it.
+
+    Time waiting for a render thread counts as render, time waiting for
+    ffmpeg to take a frame (and to finish) as encode.
+    """
+    loop = asyncio.get_running_loop()
+    partial = output + '.part'
+    cmd = pipe_command(atlas, partial)
+    proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.PIPE,
+                                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        try:
+            for text in texts:
+                with timings.stage('render'):
+                    frame = await loop.run_in_executor(None, render_gray_bytes, atlas, text)
+                with timings.stage('encode'):
+                    proc.stdin.write(frame)
+                    await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ffmpeg exited early; its status and stderr explain why
+        # communicate() only closes stdin when it is given input to send
+        proc.stdin.close()
+        with timings.stage('encode'):
+            _, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+        with timings.stage('move'):
+            os.replace(partial, output)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+async def in_thread(fn):
+    """Run fn in the thread pool; a thread can't be interrupted, so when
+    cancelled this still waits for it (keeping its encode slot) before
+    re-raising"""
+    future = asyncio.get_running_loop().run_in_executor(None, fn)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.gather(future, return_exceptions=True)
+        raise
+
+
+def render_gray_bytes(atlas, text):
+    return atlas.render_gray(text).tobytes()
+
+
+async def run_generate(encoder, video_id):
+    """Plan, wait for an encode slot, encode into the store; the job result"""
+    global _encoding
+    loop = asyncio.get_running_loop()
+    timings = Timings()
+    with timings.stage('plan'):
+        data = wsgi.generate_password_steps()
+
+    async with encode_slots():
+        _encoding += 1
+        try:
+            atlas = await loop.run_in_executor(None, wsgi.get_atlas)
+            video_path = wsgi.video_store.reserve(video_id, encoder.extension)
+            try:
+                if encoder.name == 'mp4' and encoder.backend == 'ffmpeg' and ffmpeg_path():
+                    await encode_ffmpeg(data['steps'], video_path, atlas, timings)
+                else:
+                    await in_thread(functools.partial(
+                        encoder.encode, data['steps'], video_path, atlas, timings=timings))
+            except BaseException:
+                if os.path.exists(video_path):
+                    os.remove(video_path)
+                raise
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            metrics.ENCODER_FAILURES.inc('error')
+            raise RuntimeError('Failed to create video. Make sure ffmpeg is installed.')
+        finally:
+            _encoding -= 1
+
+    timings.observe()
+    metrics.FRAMES_PER_VIDEO.observe(len(data['steps']))
+    metrics.BYTES_WRITTEN.inc(amount=wsgi.video_store.add(video_id, encoder.extension))
+    return {
+        'password': data['target_password'],
+        'video_url': f'/videos/{video_id}',
+        'format': encoder.name,
+        'mimetype': encoder.mimetype,
+        'frames': len(data['steps'])
+    }, timings
+
+
+def remember(video_id, result):
+    now = time.time()
+    for expired in [key for key, (created, _) in _results.items() if now - created > JOB_TTL]:
+        del _results[expired]
+    _results[video_id] = (now, result)
+
+
+async def generate(scope, receive, send, headers):
+    """POST /generate: a video (waiting for it here) or, in plan mode, the plan"""
+    global _in_flight
+    body = await read_body(receive)
+    try:
+        options = json.loads(body) if body else {}
+    except ValueError:
+        options = {}
+    if not isinstance(options, dict):
+        options = {}
+    query = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+
+    if wants_plan(options, query, headers):
+        plan = new_plan(max_steps=PLAN_MAX_STEPS).to_dict()
+        plan['success'] = True
+        plan['layout'] = wsgi.PLAN_LAYOUT
+        return await respond_json(send, plan, headers=[('vary', 'Accept')])
+
+    try:
+        encoder = get_encoder(options.get('format') or query.get('format'))
+    except ValueError as e:
+        return await error(send, str(e), 400)
+    if _in_flight >= ASYNC_MAX_IN_FLIGHT:
+        return await error(send, 'Too many videos are being generated; try again shortly', 429,
+                           [('retry-after', str(ASYNC_RETRY_AFTER))])
+
+    _in_flight += 1
+    video_id = str(uuid.uuid4())
+    task = asyncio.ensure_future(run_generate(encoder, video_id))
+    hangup = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await asyncio.wait((task, hangup), return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            task.cancel()  # the client hung up; nobody will fetch the video
+            await asyncio.gather(task, return_exceptions=True)
+            return
+    finally:
+        _in_flight -= 1
+        hangup.cancel()
+    try:
+        result, timings = task.result()
+    except Exception as e:
+        return await error(send, str(e), 500)
+
+    remember(video_id, result)
+    await respond_json(send, dict(result, success=True, job_id=video_id, status='done',
+                                  status_url=f'/jobs/{video_id}'),
+                       headers=[('server-timing', timings.header())])
+
+
+async def job_status(send, video_id):
+    """GET /jobs/<id>: requests here finish before /generate answers, so
+    every known job is done"""
+    entry = _results.get(video_id)
+    if entry is None or time.time() - entry[0] > JOB_TTL:
+        return await error(send, 'Unknown or expired job', 404)
+    result = dict(entry[1])
+    frames = result.pop('frames')
+    await respond_json(send, dict(result, success=True, job_id=video_id, status='done',
+                                  progress={'frames_done': frames, 'frames_total': frames}))
+
+
+async def video(scope, send, headers, video_id):
+    """GET /videos/<id> with the WSGI app's ranges and validators
+
+    Sent with the server's zero-copy extension when it has one, otherwise
+    read in chunks in the thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    path = wsgi.video_store.get(video_id)
+    try:
+        if path is None:
+            raise FileNotFoundError(video_id)
+        file = await loop.run_in_executor(None, open, path, 'rb')
+    except FileNotFoundError:
+        return await error(send, 'Unknown or expired video', 404)
+    try:
+        stat = os.fstat(file.fileno())
+        etag, modified = video_serving.validators(video_id, stat)
+        status, start, length = video_serving.evaluate(etag, modified, stat.st_size, headers,
+                                                       scope['method'])
+        extra = video_serving.response_headers(etag, modified, status, start, length, stat.st_size)
+        if status not in (200, 206):
+            return await respond(send, status, b'', headers=extra)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', mimetype_for(path).encode()),
+                        (b'content-length', str(length).encode())]
+                       + [(name.lower().encode(), value.encode()) for name, value in extra]
+        })
+        if scope['method'] == 'HEAD':
+            return await send({'type': 'http.response.body', 'body': b''})
+        if 'http.response.zerocopysend' in scope.get('extensions', {}):
+            return await send({'type': 'http.response.zerocopysend', 'file': file,
+                               'offset': start, 'count': length})
+        end = start + length
+        while start < end:
+            data = await loop.run_in_executor(None, os.pread, file.fileno(),
+                                              min(video_serving.CHUNK, end - start), start)
+            if not data:
+                break
+            start += len(data)
+            await send({'type': 'http.response.body', 'body': data, 'more_body': start < end})
+    finally:
+        file.close()
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def index(send):
+    global _page
+    if _page is None:
+        _page = await asyncio.get_running_loop().run_in_executor(None, read_file, TEMPLATE)
+    await respond(send, 200, _page, 'text/html; charset=utf-8')
+
+
+async def lifespan(receive, send):
+    """Warm up before taking requests, as gunicorn.conf.py does for the WSGI app"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(None, wsgi.warm)
+            encode_slots()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return  # no websockets
+    path, method = scope['path'], scope['method']
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+               for name, value in scope.get('headers', ())}
+    routes = {
+        '/': (('GET',), lambda: index(send)),
+        '/generate': (('POST',), lambda: generate(scope, receive, send, headers)),
+        '/metrics': (('GET',), lambda: respond(send, 200, metrics.registry.render().encode(),
+                                               'text/plain; version=0.0.4')),
+    }
+    prefix, _, rest = path[1:].partition('/')
+    if prefix == 'jobs' and rest and '/' not in rest:
+        routes[path] = (('GET',), lambda: job_status(send, rest))
+    elif prefix == 'videos' and rest and '/' not in rest:
+        routes[path] = (('GET', 'HEAD'), lambda: video(scope, send, headers, rest))
+    if path not in routes:
+        return await error(send, 'Not found', 404)
+    allowed, handler = routes[path]
+    if method not in allowed:
+        return await error(send, 'Method not allowed', 405, [('allow', ', '.join(allowed))])
+    await handler()
+
+
+def main():
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('Needs an ASGI server: pip install uvicorn, then uvicorn asgi:app')
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""In-process H.264 encoding through PyAV (libav bindings)
+
+Optional: pip install av, then MP4_BACKEND=pyav. Encoding inside the worker
+skips what every subprocess encode pays for: spawning ffmpeg, probing the
+rawvideo input, setting up the codec from scratch and buffering its stderr.
+Frames go from the atlas straight into a libx264 encoder context; codec,
+pixel format and x264 settings (the defaults, no tune) are the same as the
+ffmpeg path's.
+"""
+import os
+from fractions import Fraction
+
+from metrics import Timings
+from plan import FRAME_SECONDS
+from video_encoder import PIX_FMT, VIDEO_CODEC
+
+# The av module, imported by available(): it takes tens of milliseconds, so
+# processes that never encode MP4s don't pay for it
+av = None
+_probed = False
+
+
+def available():
+    """Whether PyAV is installed (optional; encoders falls back to ffmpeg)"""
+    global av, _probed
+    if not _probed:
+        try:
+            import av as module
+            av = module
+        except ImportError:
+            pass
+        _probed = True
+    return av is not None
+
+
+def gray_frame(image):
+    """Wrap an 'L' image as an av.VideoFrame without going through NumPy"""
+    frame = av.VideoFrame(image.width, image.height, 'gray')
+    plane = frame.planes[0]
+    data = image.tobytes()
+    if plane.line_size != image.width:
+        # libav pads rows to its own alignment
+        padding = bytes(plane.line_size - image.width)
+        data = b''.join(data[y * image.width:(y + 1) * image.width] + padding
+                        for y in range(image.height))
+    plane.update(data)
+    return frame
+
+
+def encode_av(texts, output, atlas, progress=None, timings=None):
+    """Encode one frame per text into output (MP4), replacing it atomically"""
+    timings = timings if timings is not None else Timings()
+    partial = output + '.part'
+    try:
+        container = av.open(partial, mode='w', format='mp4')
+        try:
+            stream = container.add_stream(VIDEO_CODEC, rate=Fraction(1, FRAME_SECONDS))
+            stream.width = atlas.width
+            stream.height = atlas.height
+            stream.pix_fmt = PIX_FMT
+            for i, text in enumerate(texts):
+                with timings.stage('render'):
+                    frame = gray_frame(atlas.render_gray(text))
+                with timings.stage('encode'):
+                    # Same gray -> limited-range YUV conversion as ffmpeg's
+                    frame = frame.reformat(format=PIX_FMT)
+                    frame.pts = i
+                    for packet in stream.encode(frame):
+                        container.mux(packet)
+                if progress:
+                    progress()
+            with timings.stage('encode'):
+                for packet in stream.encode():
+                    container.mux(packet)
+        finally:
+            container.close()
+        with timings.stage('move'):
+            os.replace(partial, output)
+    finally:
+        with timings.stage('cleanup'):
+            if os.path.exists(partial):
+                os.remove(partial)
+    return output
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Vectorized batch plan generation with NumPy
+
+generate_plans(n) advances n independent copies of the plan.walk() state
+machine in lockstep on NumPy arrays, for capacity-planning simulations and
+for pre-filling pools. Plans come from the same distribution as
+plan.new_plan(), just not the same random stream: iterations of the walk in
+which nothing happens are skipped by drawing each step conditioned on it
+doing something.
+
+Requires NumPy (pip install numpy); the web app never imports this module.
+
+    python batch_plans.py [n]   # check the distribution and time it
+"""
+import math
+import random
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from plan import DELETE, MAX_STEPS, Plan, new_plan
+
+MIN_LENGTH = 10
+MAX_LENGTH = 15
+
+
+class PlanBatch:
+    """n plans stored column-wise
+
+    Plan i has lengths[i] digits, targets[i] as its target indices and
+    counts[i] steps, deletions[i] of which delete. Its steps, as plan.Plan
+    stores them, are the first counts[i] rows of column columns[i] of ops
+    and on_screen; the rows below are scratch. Its random string is the
+    digits it enters, in order. order lists the plans by column.
+    """
+
+    def __init__(self, lengths, targets, ops, on_screen, order):
+        self.lengths = lengths
+        self.targets = targets
+        self.ops = ops
+        self.on_screen = on_screen
+        self.order = order
+        self._columns = None
+        # Every digit is entered once and all but the 4 targets deleted
+        self.counts = 2 * lengths - 4
+        self.deletions = lengths - 4
+
+    @property
+    def columns(self):
+        """Column of each plan; built on first use"""
+        if self._columns is None:
+            self._columns = np.empty(len(self.order), dtype=np.intp)
+            self._columns[self.order] = np.arange(len(self.order))
+        return self._columns
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def plan(self, i):
+        """Plan i as a plan.Plan"""
+        count = int(self.counts[i])
+        column = self.columns[i]
+        ops = self.ops[:count, column]
+        random_string = (ops[ops != DELETE] + 48).tobytes().decode('ascii')
+        return Plan(random_string, self.targets[i].tolist(), array('b', ops.tobytes()),
+                    array('b', self.on_screen[:count, column].tobytes()))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.plan(i)
+
+
+# Rows of the per-plan state matrix used by generate_plans
+GAP, GAPS, CORRECT, PENDING = range(4)
+
+# Random bytes at or past this are redrawn; 240 = 6 * 10 * 4, so thresholds
+# on the rest split them into halves and thirds exactly, and b % 10 is an
+# exactly uniform digit independent of either
+ROLL_LIMIT = 240
+
+
+def raw_bytes(rng, size):
+    """size uniform bytes; raw 64-bit draws cost a fraction of rng.bytes()"""
+    return rng.bit_generator.random_raw(-(-size // 8)).view(np.uint8)[:size]
+
+
+def random_bytes(rng, size):
+    """size uniform bytes below ROLL_LIMIT"""
+    draws = raw_bytes(rng, size)
+    # Replace the 1 in 16 rejects with arithmetic rather than finding them,
+    # then look for the few that drew badly twice
+    rejected = (draws >= ROLL_LIMIT).view(np.uint8)
+    draws += rejected * (raw_bytes(rng, size) - draws)
+    redraw = np.flatnonzero(draws >= ROLL_LIMIT)
+    while redraw.size:
+        fresh = raw_bytes(rng, redraw.size)
+        draws[redraw] = fresh
+        redraw = redraw[fresh >= ROLL_LIMIT]
+    return draws
+
+
+def generate_plans(n, rng=None):
+    """Generate n random plans at once"""
+    rng = rng if rng is not None else np.random.default_rng()
+
+    # String lengths (10-15 digits); the digits themselves are drawn as they
+    # are typed, since nothing in the walk depends on them
+    lengths = rng.integers(MIN_LENGTH, MAX_LENGTH + 1, n, dtype=np.int8)
+
+    # Target indices, as in plan.pick_target_indices: uniform draws scaled to
+    # each plan's own range
+    first = (rng.random(n) * (lengths - 5)).astype(np.int8)
+    second = first + 1 + (rng.random(n) * (lengths - 4 - first)).astype(np.int8)
+    targets = np.stack([first, second, lengths - 2, lengths - 1], axis=1)
+
+    # One row per state variable, one column per plan, longest plans first.
+    # A plan has exactly 2 * length - 4 steps and every pass below takes one
+    # step of each unfinished plan, so the plans still going are always a
+    # prefix of the columns, and step t of all of them is row t of ops and
+    # on_screen. Plans have at most MAX_STEPS steps, so int8 is wide enough
+    # for everything.
+    order = np.argsort(-lengths, kind='stable')
+    state = np.zeros((4, n), dtype=np.int8)
+    # Digits still to type before the next target, and the gaps after the
+    # first and second targets, 4 bits each (after the third it is 0)
+    first, second, last = first[order], second[order], lengths[order] - 1
+    state[GAP] = first
+    state[GAPS] = ((second - first - 1) | ((last - second - 2) << 4)).view(np.int8)
+    ops = np.zeros((MAX_STEPS, n), dtype=np.int8)
+    # Digits on screen after each step, below a row of zeros for the start
+    screens = np.zeros((MAX_STEPS + 1, n), dtype=np.int8)
+    # Plans still going at pass t: those with more than t steps
+    going = n - np.cumsum(np.bincount(2 * lengths - 4, minlength=MAX_STEPS + 1))[:MAX_STEPS]
+
+    for t, size in enumerate(going.tolist()):
+        on_screen, gap, correct = screens[t, :size], state[GAP, :size], state[CORRECT, :size]
+        gaps = state[GAPS, :size].view(np.uint8)
+        pending = state[PENDING, :size].view(bool)
+
+        # Prevent entering 4th digit unless we're at the last position,
+        # i.e. until the third target is in; there is always a non-target
+        # digit on screen to delete then. A plan that entered a digit last
+        # pass and still owes that iteration's deletion does only that.
+        blocked = (on_screen == 3) & (correct < 3) & ~pending
+        free = ~(pending | blocked)
+        at_target = free & (gap == 0)
+        coin_flip = free ^ at_target
+        # Target digits are never deleted, so correct <= on_screen
+        can_delete = correct < on_screen
+        # A target digit is only typed if it lands in the right spot
+        enter_target = at_target & ~can_delete
+
+        # Iterations of plan.walk() that neither enter nor delete change
+        # nothing, so instead of simulating them each iteration draws the
+        # next step conditioned on something happening:
+        # - blocked, or at a target that would land in the wrong spot: the
+        #   deletion coin is the only one left, so delete
+        # - coin flip with a deletable digit: enter / enter+delete / delete,
+        #   1/3 each
+        # - coin flip without one: enter / enter+delete, 1/2 each
+        # One roll, uniform on 0-239, serves both the 1/3 and the 1/2 cases
+        # exactly, and its last decimal digit is the digit entered.
+        roll = random_bytes(rng, size)
+        three_way = coin_flip & can_delete
+        two_way = coin_flip ^ three_way
+        enter = enter_target | two_way | (three_way & (roll < 160))
+        delete = blocked | (at_target ^ enter_target) | (three_way & (roll >= 80))
+        delete |= two_way & (roll < 120)
+
+        # An iteration that enters and deletes takes two passes: the digit
+        # now, the deletion next time
+        deleting = pending | (delete & ~enter)
+        pending[:] = enter & delete
+        entering = enter.view(np.int8)
+        np.add(on_screen, entering, out=screens[t + 1, :size])
+        screens[t + 1, :size] -= deleting.view(np.int8)
+        # Past a target, the gap to the next one comes off the queue
+        hit = enter_target.view(np.uint8)
+        correct += hit.view(np.int8)
+        gap -= entering
+        gap += (((gaps & 15) + 1) * hit).view(np.int8)
+        gaps >>= hit << 2
+        # roll % 10, with roll // 10 as a multiply-shift
+        wide = roll.astype(np.uint16)
+        digit = (wide - ((wide * 205) >> 11) * 10).astype(np.int8)
+        np.multiply(digit, entering, out=ops[t, :size])
+        ops[t, :size] -= deleting.view(np.int8)
+
+    return PlanBatch(lengths, targets, ops, screens[1:], order)
+
+
+def ks_statistic(a, b):
+    """Two-sample Kolmogorov-Smirnov statistic"""
+    a, b = np.sort(a), np.sort(b)
+    values = np.concatenate([a, b])
+    cdf_a = np.searchsorted(a, values, side='right') / len(a)
+    cdf_b = np.searchsorted(b, values, side='right') / len(b)
+    return float(np.max(np.abs(cdf_a - cdf_b)))
+
+
+def ks_critical(n, m, alpha=0.001):
+    """Rejection threshold for ks_statistic at significance alpha"""
+    return math.sqrt(-math.log(alpha / 2) / 2) * math.sqrt((n + m) / (n * m))
+
+
+def longest_entry_run(plan):
+    """Most digits entered in a row without a deletion"""
+    longest = run = 0
+    for op in plan.ops:
+        run = 0 if op == DELETE else run + 1
+        longest = max(longest, run)
+    return longest
+
+
+def best_rate(make, count, runs=3):
+    """(Best items per second over runs calls of make(), the last result)"""
+    best = math.inf
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = make()
+        best = min(best, time.perf_counter() - start)
+    return count / best, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sample = min(n, 20000)
+
+    # Best of a few runs of each, so one noisy run doesn't skew the ratio
+    rng = random.Random(0)
+    scalar_rate, scalar = best_rate(lambda: [new_plan(rng) for _ in range(sample)], sample)
+    generate_plans(1000)  # the first call pays NumPy's one-time setup
+    batch_rate, batch = best_rate(lambda: generate_plans(n, np.random.default_rng(0)), n)
+
+    # Compare the distributions that drive video length and the password,
+    # plus features of the step sequence itself
+    batched = [batch.plan(i) for i in range(sample)]
+
+    def features(plans):
+        return {
+            'steps': [len(p) for p in plans],
+            'string length': [len(p.random_string) for p in plans],
+            'first target': [p.target_indices[0] for p in plans],
+            'second target': [p.target_indices[1] for p in plans],
+            'first delete': [p.ops.index(DELETE) if DELETE in p.ops else -1 for p in plans],
+            'longest entry run': [longest_entry_run(p) for p in plans],
+            'on-screen area': [sum(p.on_screen) for p in plans],
+        }
+
+    expected, actual = features(scalar), features(batched)
+    checks = {name: (expected[name], actual[name]) for name in expected}
+    threshold = ks_critical(sample, sample)
+    ok = True
+    for name, (a, b) in checks.items():
+        d = ks_statistic(np.asarray(a), np.asarray(b))
+        ok &= d < threshold
+        print(f"{name:>17}: KS D = {d:.4f} ({'ok' if d < threshold else 'MISMATCH'}, threshold {threshold:.4f})")
+
+    print(f"Scalar plans: {scalar_rate:12,.0f}/s")
+    print(f"Batch plans:  {batch_rate:12,.0f}/s ({batch_rate / scalar_rate:.0f}x)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
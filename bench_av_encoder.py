@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Benchmark: ffmpeg subprocess vs. in-process PyAV for MP4 encoding
+
+Usage: python bench_av_encoder.py [plans] [requests_per_second]
+
+A one-frame video isolates the fixed cost of each path (process spawn and
+input probing vs. opening a container and codec context); full plans show
+the per-video total. CPU time includes the ffmpeg child processes.
+"""
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import av_encoder
+from frame_atlas import FrameAtlas, template_lines
+from plan import new_plan
+from video_encoder import encode_video
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run(encode, plans, output, atlas):
+    """Median wall time and mean CPU time per video, in seconds"""
+    walls = []
+    cpu_start = cpu_seconds()
+    for texts in plans:
+        start = time.perf_counter()
+        encode(texts, output, atlas)
+        walls.append(time.perf_counter() - start)
+    walls.sort()
+    return walls[len(walls) // 2], (cpu_seconds() - cpu_start) / len(plans)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    if not av_encoder.available():
+        print("PyAV is not installed (pip install av); nothing to compare")
+        return
+    if shutil.which('ffmpeg') is None:
+        print("ffmpeg not found; nothing to compare")
+        return
+
+    atlas = FrameAtlas().preload(template_lines())
+    rng = random.Random(0)
+    plans = [new_plan(rng).steps() for _ in range(count)]
+    single = [[texts[0]] for texts in plans]
+    work_dir = tempfile.mkdtemp(prefix='bench_av_encoder_')
+    try:
+        output = os.path.join(work_dir, 'out.mp4')
+        # Warm up both paths (libav and x264 init, page cache for ffmpeg)
+        encode_video(single[0], output, atlas)
+        av_encoder.encode_av(single[0], output, atlas)
+
+        print(f"{count} plans; per video: median wall / mean CPU")
+        results = {}
+        for label, videos in (('1 frame', single), ('full plan', plans)):
+            sub = run(encode_video, videos, output, atlas)
+            inproc = run(av_encoder.encode_av, videos, output, atlas)
+            results[label] = (sub, inproc)
+            print(f"{label:<10} subprocess {sub[0] * 1000:7.1f} ms / {sub[1] * 1000:7.1f} ms CPU   "
+                  f"PyAV {inproc[0] * 1000:7.1f} ms / {inproc[1] * 1000:7.1f} ms CPU")
+
+        (sub_wall, sub_cpu), (av_wall, av_cpu) = results['1 frame']
+        print(f"Fixed cost saved per video: {(sub_wall - av_wall) * 1000:.1f} ms wall, "
+              f"{(sub_cpu - av_cpu) * 1000:.1f} ms CPU")
+        (sub_wall, sub_cpu), (av_wall, av_cpu) = results['full plan']
+        print(f"At {rate:g} videos/s: {(sub_cpu - av_cpu) * rate:.3f} CPU cores saved "
+              f"({sub_cpu * rate:.2f} -> {av_cpu * rate:.2f})")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
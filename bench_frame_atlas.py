@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Benchmark: create_text_image vs. FrameAtlas frame composition
+
+Usage: python bench_frame_atlas.py [number_of_plans]
+"""
+import random
+import sys
+import time
+from app import COMPLETION_LINE, create_text_image
+from frame_atlas import FrameAtlas, template_lines
+from plan import new_plan
+
+
+def time_per_frame(render, texts, repeat=3):
+    """Best-of-N average milliseconds per frame"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            render(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(texts) * 1000
+
+
+def main():
+    plans = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = random.Random(0)
+    texts = []
+    for _ in range(plans):
+        texts.extend(new_plan(rng).steps(COMPLETION_LINE))
+
+    start = time.perf_counter()
+    atlas = FrameAtlas().preload(template_lines())
+    preload_ms = (time.perf_counter() - start) * 1000
+
+    # Outputs must match before the timings mean anything
+    for text in texts:
+        if atlas.render(text).tobytes() != create_text_image(text).tobytes():
+            print(f"❌ Frame mismatch for: {text!r}")
+            sys.exit(1)
+
+    baseline = time_per_frame(create_text_image, texts)
+    composed = time_per_frame(atlas.render, texts)
+    gray = time_per_frame(atlas.render_gray, texts)
+    print(f"Frames:            {len(texts)} ({plans} plans)")
+    print(f"Atlas preload:     {preload_ms:.1f} ms ({atlas.stats()['bands']} bands)")
+    print(f"create_text_image: {baseline:.3f} ms/frame")
+    print(f"FrameAtlas.render: {composed:.3f} ms/frame")
+    print(f"render_gray:       {gray:.3f} ms/frame")
+    print(f"Speedup:           {baseline / composed:.1f}x (RGB), {baseline / gray:.1f}x (gray)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Benchmark: serial frame loop vs. RenderPool for a worst-case plan
+
+Usage: python bench_render_pool.py [processes] [plans_to_sample]
+
+The longest plan out of plans_to_sample random ones is used, so the numbers
+reflect the slowest videos /generate has to produce.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from app import COMPLETION_LINE, get_atlas
+from plan import new_plan, template_lines
+from render_pool import RenderPool
+from video_encoder import encode_video
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 2)
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    rng = random.Random(0)
+    texts = max((new_plan(rng).steps(COMPLETION_LINE) for _ in range(samples)), key=len)
+    print(f"Worst case of {samples} plans: {len(texts)} frames; {processes} processes")
+    atlas = get_atlas()
+
+    pool = RenderPool(processes=processes, warm_lines=template_lines())
+    work_dir = tempfile.mkdtemp(prefix="bench_render_pool_")
+    try:
+        paths = [os.path.join(work_dir, f"frame_{i:03d}.png") for i in range(len(texts))]
+
+        def serial_files():
+            for text, path in zip(texts, paths):
+                atlas.render(text).save(path)
+
+        # Start the workers outside the timed runs; the pool stays warm in
+        # the app, so start-up isn't part of a request
+        startup = timed(pool.render_files, texts[:processes], paths[:processes])
+
+        serial_png = timed(serial_files)
+        pool_png = timed(pool.render_files, texts, paths)
+        print(f"Pool start-up:          {startup * 1000:8.1f} ms")
+        print(f"Render+save PNG serial: {serial_png * 1000:8.1f} ms")
+        print(f"Render+save PNG pool:   {pool_png * 1000:8.1f} ms ({serial_png / pool_png:.2f}x)")
+
+        if shutil.which('ffmpeg') is None:
+            print("ffmpeg not found; skipping encode timings")
+            return
+        output = os.path.join(work_dir, "video.mp4")
+        serial_encode = timed(encode_video, texts, output, atlas)
+        pool_encode = timed(pool.encode, texts, output)
+        print(f"Encode serial (pipe):   {serial_encode * 1000:8.1f} ms")
+        print(f"Encode pool (chunks):   {pool_encode * 1000:8.1f} ms ({serial_encode / pool_encode:.2f}x)")
+    finally:
+        pool.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Benchmark: app start-up time and per-worker memory, with and without preload
+
+Usage: python bench_startup.py [workers] [runs]
+
+Import time is measured in fresh interpreters: importing the app (which
+must not load PIL) and then warm(). Memory comes from gunicorn started with
+GUNICORN_PRELOAD=1 and =0, read from each worker's /proc/<pid>/smaps_rollup
+once the server answers: RSS counts shared pages in full, PSS splits them
+between the processes sharing them, and private memory is what a worker
+alone holds.
+"""
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import application
+imported = time.perf_counter()
+pil = 'PIL' in sys.modules
+application.warm()
+print(imported - start, time.perf_counter() - imported, pil)
+"""
+
+
+def import_times(runs):
+    """Median seconds to import and to warm, and whether the import loaded PIL"""
+    imports, warms, pil = [], [], False
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], check=True,
+                             capture_output=True, text=True).stdout.split()
+        imports.append(float(out[0]))
+        warms.append(float(out[1]))
+        pil |= out[2] == 'True'
+    return statistics.median(imports), statistics.median(warms), pil
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def memory(pid):
+    """RSS, PSS and private memory of a process, in KiB"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Rss'], fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def serve(preload, workers, timeout=60):
+    """Start gunicorn; seconds until it answers, and each worker's memory"""
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0')
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', '4',
+         '--bind', f'127.0.0.1:{port}', 'application:application'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+                break
+            except OSError:
+                if time.perf_counter() - start > timeout or server.poll() is not None:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.05)
+        ready = time.perf_counter() - start
+        # Let every worker finish starting (and warming, without preload)
+        while len(children(server.pid)) < workers:
+            time.sleep(0.05)
+        time.sleep(2)
+        return ready, [memory(pid) for pid in children(server.pid)], memory(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    imported, warmed, pil = import_times(runs)
+    print(f"import application: {imported * 1000:.0f} ms ({'loads' if pil else 'no'} PIL); "
+          f"warm(): {warmed * 1000:.0f} ms")
+
+    print(f"{workers} workers        ready    RSS/worker  PSS/worker  private/worker  master RSS")
+    for preload in (False, True):
+        ready, usage, master = serve(preload, workers)
+        rss, pss, private = (statistics.mean(column) / 1024 for column in zip(*usage))
+        print(f"preload {'on ' if preload else 'off'}     {ready:6.2f} s  {rss:8.1f} MiB {pss:8.1f} MiB "
+              f"{private:11.1f} MiB  {master[0] / 1024:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
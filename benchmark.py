@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the password/video generation pipeline
+
+Times each stage on its own and reports latency percentiles plus memory
+allocated per call (tracemalloc). Results can be saved as a JSON baseline
+and later runs compared against it.
+
+    python benchmark.py                       # run every stage
+    python benchmark.py -n 500 plan atlas_render   # only some stages
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json [--threshold 10]
+    python benchmark.py --stub-encoder        # no real ffmpeg needed
+
+Without ffmpeg on PATH (or with --stub-encoder) fake_ffmpeg.py stands in for
+it with no added latency or CPU, so encode and end-to-end timings then cover
+everything except the encoder itself.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import fake_ffmpeg
+
+# Stages that spawn ffmpeg run this many times fewer iterations
+SLOW_STAGE_DIVISOR = 20
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def measure(fn, iterations, alloc_samples=20):
+    """Time fn() iterations times, then sample its allocations"""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    peak = 0
+    for _ in range(min(alloc_samples, iterations)):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    timings.sort()
+    ms = [t * 1000 for t in timings]
+    return {
+        'n': iterations,
+        'mean_ms': sum(ms) / len(ms),
+        'p50_ms': percentile(ms, 50),
+        'p90_ms': percentile(ms, 90),
+        'p99_ms': percentile(ms, 99),
+        'max_ms': ms[-1],
+        'peak_alloc_bytes': peak,
+    }
+
+
+def build_stages(work_dir):
+    """Stage name -> (callable, is_slow)"""
+    import app
+    from plan import generate_random_string, new_plan, pick_target_indices, walk
+    from video_encoder import encode_video, stream_fragmented
+
+    # Same plan and digit draws every run, so runs can be compared
+    rng = random.Random(0)
+    plan = new_plan(rng)
+    steps = plan.steps()
+    frame_text = steps[len(steps) // 2]
+    frame = app.get_atlas().render(frame_text)
+    png_path = os.path.join(work_dir, 'frame.png')
+    video_path = os.path.join(work_dir, 'video.mp4')
+    client = app.app.test_client()
+
+    def end_to_end():
+        job = client.post('/generate').get_json()
+        while True:
+            status = client.get(job['status_url']).get_json()
+            if status['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.001)
+        if status['status'] == 'failed':
+            raise RuntimeError(status['error'])
+        app.video_store.remove(job['job_id'])
+
+    def stream_first_frame():
+        # Header plus the first fragment: what a player needs to show step 1
+        stream = stream_fragmented(steps, app.get_atlas())
+        data = b''
+        for chunk in stream:
+            data += chunk
+            if b'moof' in data:
+                break
+        stream.close()
+
+    return {
+        'random_string': (lambda: generate_random_string(rng.randint(10, 15), rng), False),
+        'target_indices': (lambda: pick_target_indices(rng.randint(10, 15), rng), False),
+        'step_loop': (lambda: walk(plan.random_string, plan.target_indices, rng), False),
+        'plan': (app.generate_password_steps, False),
+        'create_text_image': (lambda: app.create_text_image(frame_text), False),
+        'atlas_render': (lambda: app.get_atlas().render(frame_text), False),
+        'png_save': (lambda: frame.save(png_path), False),
+        'encode': (lambda: encode_video(steps, video_path, app.get_atlas()), True),
+        'generate_plan': (lambda: client.post('/generate?mode=plan'), False),
+        'stream_first_frame': (stream_first_frame, True),
+        'generate_e2e': (end_to_end, True),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print p50 changes against a baseline; returns True if nothing regressed"""
+    ok = True
+    print(f"\n{'stage':<18} {'baseline p50':>13} {'now p50':>10} {'change':>8}")
+    for name, stats in results['stages'].items():
+        old = baseline['stages'].get(name)
+        if old is None or old['p50_ms'] == 0:
+            continue
+        change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"{name:<18} {old['p50_ms']:>11.3f}ms {stats['p50_ms']:>8.3f}ms {change:>+7.1f}%{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline")
+    parser.add_argument('stages', nargs='*', help='stages to run (default: all)')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--save', metavar='FILE', help='write results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='p50 slowdown (%%) counted as a regression')
+    parser.add_argument('--stub-encoder', action='store_true',
+                        help='use a stub instead of ffmpeg')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        stub = args.stub_encoder or shutil.which('ffmpeg') is None
+        if stub:
+            fake_ffmpeg.install(work_dir, latency=0, cpu=0)
+
+        stages = build_stages(work_dir)
+        selected = args.stages or list(stages)
+        unknown = [name for name in selected if name not in stages]
+        if unknown:
+            parser.error(f"unknown stage(s): {', '.join(unknown)}; choose from {', '.join(stages)}")
+
+        results = {
+            'meta': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'encoder': 'stub' if stub else 'ffmpeg',
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'stages': {},
+        }
+        print(f"Encoder: {results['meta']['encoder']}")
+        print(f"{'stage':<18} {'n':>5} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'peak alloc':>11}")
+        for name in selected:
+            fn, slow = stages[name]
+            iterations = max(3, args.iterations // SLOW_STAGE_DIVISOR) if slow else args.iterations
+            fn()  # warm up
+            stats = measure(fn, iterations, alloc_samples=3 if slow else 20)
+            results['stages'][name] = stats
+            print(f"{name:<18} {stats['n']:>5} {stats['p50_ms']:>7.3f}ms {stats['p90_ms']:>7.3f}ms "
+                  f"{stats['p99_ms']:>7.3f}ms {stats['max_ms']:>7.3f}ms {stats['peak_alloc_bytes'] / 1024:>8.1f}KiB")
+
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"\nSaved baseline to {args.save}")
+
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            if not compare(results, baseline, args.threshold):
+                sys.exit(1)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Pluggable output encoders
+
+Every encoder turns the frame texts of one plan into a single file:
+
+* mp4: H.264 through the ffmpeg binary (video_encoder.encode_video), or
+  in-process through PyAV with MP4_BACKEND=pyav
+* webp, apng, gif: animated images written in-process by Pillow, so no
+  ffmpeg binary is needed at all
+
+The frames are white text on black, so the Pillow backends drop most of the
+gray levels before saving: 1-bit for APNG and WebP (lossless), a 4-entry
+gray palette for GIF, keeping a little anti-aliasing where LZW can afford it.
+
+    python encoders.py [plans]   # latency and size of every backend
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import av_encoder
+from metrics import ENCODER_FAILURES, Timings
+from plan import FRAME_SECONDS
+from video_encoder import encode_video
+
+# Output format when a request doesn't ask for one
+VIDEO_FORMAT = os.environ.get('VIDEO_FORMAT', 'mp4')
+
+# How MP4s are encoded: ffmpeg, pyav, or auto (pyav if it is installed)
+MP4_BACKEND = os.environ.get('MP4_BACKEND', 'ffmpeg')
+
+# Gray level -> 1-bit pixel
+ONE_BIT = [0] * 128 + [255] * 128
+
+# Gray level -> index into GRAY4_PALETTE
+GRAY4_INDEX = [min(3, (v + 42) // 85) for v in range(256)]
+GRAY4_PALETTE = [0, 0, 0, 85, 85, 85, 170, 170, 170, 255, 255, 255]
+
+
+def one_bit(frame):
+    return frame.point(ONE_BIT, '1')
+
+
+def one_bit_gray(frame):
+    # WebP has no 1-bit input mode; two gray levels let its lossless coder
+    # pick a 2-color palette by itself
+    return frame.point(ONE_BIT)
+
+
+def gray4(frame):
+    image = frame.point(GRAY4_INDEX).convert('P')
+    image.putpalette(GRAY4_PALETTE)
+    return image
+
+
+class Mp4Encoder:
+    """H.264 MP4 via the ffmpeg binary, or via PyAV in-process"""
+
+    name = 'mp4'
+    extension = '.mp4'
+    mimetype = 'video/mp4'
+
+    def __init__(self, backend=MP4_BACKEND):
+        self.requested = backend
+        self._backend = None
+        self._available = None
+
+    @property
+    def backend(self):
+        """pyav or ffmpeg; resolved on first use, which imports PyAV"""
+        if self._backend is None:
+            backend = self.requested
+            if backend == 'auto':
+                backend = 'pyav' if av_encoder.available() else 'ffmpeg'
+            elif backend == 'pyav' and not av_encoder.available():
+                backend = 'ffmpeg'  # bindings not installed
+            self._backend = backend
+        return self._backend
+
+    def available(self):
+        if self._available is None:
+            self._available = self.backend == 'pyav' or shutil.which('ffmpeg') is not None
+        return self._available
+
+    def encode(self, texts, output, atlas, progress=None, timings=None):
+        if self.backend == 'pyav':
+            try:
+                return av_encoder.encode_av(texts, output, atlas, progress, timings)
+            except av_encoder.av.FFmpegError:
+                # Retry with the binary (progress is reported again, which
+                # Job.advance clamps to the frame total)
+                ENCODER_FAILURES.inc('fallback')
+        return encode_video(texts, output, atlas, progress, timings)
+
+
+class PillowEncoder:
+    """Animated image saved by Pillow with save_all=True"""
+
+    def __init__(self, name, format, extension, mimetype, convert, feature=None, **options):
+        self.name = name
+        self.format = format
+        self.extension = extension
+        self.mimetype = mimetype
+        self.convert = convert
+        self.feature = feature
+        self.options = options
+        self._available = None
+
+    def available(self):
+        if self._available is None:
+            from PIL import features
+            self._available = self.feature is None or bool(features.check(self.feature))
+        return self._available
+
+    def encode(self, texts, output, atlas, progress=None, timings=None):
+        """Render every frame, then write them as one animation, atomically"""
+        timings = timings if timings is not None else Timings()
+        frames = []
+        for text in texts:
+            with timings.stage('render'):
+                frames.append(self.convert(atlas.render_gray(text)))
+            if progress:
+                progress()
+        partial = output + '.part'
+        try:
+            with timings.stage('encode'):
+                frames[0].save(partial, format=self.format, save_all=True,
+                               append_images=frames[1:],
+                               duration=FRAME_SECONDS * 1000, **self.options)
+            with timings.stage('move'):
+                os.replace(partial, output)
+        finally:
+            with timings.stage('cleanup'):
+                if os.path.exists(partial):
+                    os.remove(partial)
+        return output
+
+
+# loop=1: play once and stop on the last frame, like the MP4 (GIF plays once
+# unless a loop count is given)
+ENCODERS = {
+    'mp4': Mp4Encoder(),
+    'webp': PillowEncoder('webp', 'WEBP', '.webp', 'image/webp', one_bit_gray,
+                          feature='webp_anim', lossless=True, loop=1),
+    'apng': PillowEncoder('apng', 'PNG', '.png', 'image/png', one_bit, loop=1),
+    'gif': PillowEncoder('gif', 'GIF', '.gif', 'image/gif', gray4),
+}
+
+
+def get_encoder(name=None):
+    """Encoder for a format name (default VIDEO_FORMAT); ValueError if unusable"""
+    name = (name or VIDEO_FORMAT).lower()
+    encoder = ENCODERS.get(name)
+    if encoder is None:
+        raise ValueError(f"Unknown format '{name}'; choose from {', '.join(ENCODERS)}")
+    if not encoder.available():
+        raise ValueError(f"Format '{name}' is not available on this server")
+    return encoder
+
+
+def mimetype_for(path):
+    """Content type of a stored file, from its extension"""
+    extension = os.path.splitext(path)[1]
+    for encoder in ENCODERS.values():
+        if encoder.extension == extension:
+            return encoder.mimetype
+    return 'application/octet-stream'
+
+
+def main():
+    from frame_atlas import FrameAtlas, template_lines
+    from plan import new_plan
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    atlas = FrameAtlas().preload(template_lines())
+    rng = random.Random(0)
+    plans = [new_plan(rng).steps() for _ in range(count)]
+    work_dir = tempfile.mkdtemp(prefix='bench_encoders_')
+    try:
+        print(f"{count} plans, {sum(map(len, plans)) / count:.1f} frames each on average")
+        print(f"{'format':<6} {'p50':>9} {'max':>9} {'mean size':>11}")
+        for name, encoder in ENCODERS.items():
+            if not encoder.available():
+                print(f"{name:<6} not available")
+                continue
+            output = os.path.join(work_dir, 'out' + encoder.extension)
+            timings, sizes = [], []
+            for texts in plans:
+                start = time.perf_counter()
+                encoder.encode(texts, output, atlas)
+                timings.append(time.perf_counter() - start)
+                sizes.append(os.path.getsize(output))
+            timings.sort()
+            print(f"{name:<6} {timings[len(timings) // 2] * 1000:>7.1f}ms {timings[-1] * 1000:>7.1f}ms "
+                  f"{sum(sizes) / len(sizes) / 1024:>8.1f}KiB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Buffered OS entropy for passwords
+
+The passcode is a secret, so its digits and the walk that hides it come from
+os.urandom rather than the Mersenne Twister, whose state can be recovered
+from its output. A syscall per digit would be slow, so EntropyPool reads
+ENTROPY_BLOCK bytes at a time and hands them out from a buffer:
+
+* digits: each byte below 250 gives byte % 10; 250-255 are rejected, so
+  every digit is exactly equally likely
+* coin flips: the bits of getrandbits(), used one at a time by plan.walk()
+* randint: the same rejection over a single byte for ranges up to 256
+* everything else (randrange, choice, larger randint ranges):
+  random.Random's rejection over getrandbits
+
+EntropyPool subclasses random.Random, as random.SystemRandom does, so code
+written against the random API (plan.new_plan(rng)) takes it unchanged. Use
+the module's `pool`, one per worker process: a forked child drops the
+buffer it inherited, which its parent would otherwise hand out too.
+
+    python entropy.py [plans]   # uniformity checks and cost per password
+"""
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+
+# Bytes read from os.urandom at a time
+ENTROPY_BLOCK = int(os.environ.get('ENTROPY_BLOCK', 4096))
+
+# Byte -> ASCII digit, and the bytes that would bias digits (256 % 10 == 6)
+DIGIT_TABLE = bytes(48 + b % 10 for b in range(256))
+DIGIT_REJECT = bytes(range(250, 256))
+
+# Every pool, so forked children can drop what they inherited
+_pools = weakref.WeakSet()
+
+
+class EntropyPool(random.Random):
+    """random.Random API on os.urandom, read in blocks by each thread"""
+
+    def __init__(self, block=ENTROPY_BLOCK):
+        self.block = block
+        self._reset()
+        super().__init__()
+        _pools.add(self)
+
+    def _reset(self):
+        # One buffer per thread, so handing out bytes needs no lock
+        self._local = threading.local()
+
+    def seed(self, *args, **kwargs):
+        """No-op: the OS supplies the entropy"""
+
+    def getstate(self):
+        raise NotImplementedError('EntropyPool has no state to save')
+
+    setstate = getstate
+
+    def randbytes(self, n):
+        """n random bytes from the buffer, refilling it when it runs low"""
+        if n > self.block:
+            return os.urandom(n)
+        local = self._local
+        try:
+            buffer, pos = local.buffer, local.pos
+        except AttributeError:  # this thread's first call
+            buffer, pos = b'', 0
+        if pos + n > len(buffer):
+            buffer = local.buffer = os.urandom(self.block)
+            pos = 0
+        local.pos = pos + n
+        return buffer[pos:pos + n]
+
+    def getrandbits(self, k):
+        if k < 0:
+            raise ValueError('number of bits must be non-negative')
+        n = (k + 7) // 8
+        return int.from_bytes(self.randbytes(n), 'little') >> (n * 8 - k)
+
+    def random(self):
+        """Float in [0, 1) with 53 random bits"""
+        return (int.from_bytes(self.randbytes(7), 'little') >> 3) * 2 ** -53
+
+    def randint(self, a, b):
+        width = b - a + 1
+        if not 0 < width <= 256:
+            return super().randint(a, b)
+        # Largest multiple of width that fits in a byte; bytes above it are redrawn
+        limit = 256 - 256 % width
+        while True:
+            value = self.randbytes(1)[0]
+            if value < limit:
+                return a + value % width
+
+    def digits(self, n):
+        """n uniformly random decimal digits, as a string"""
+        out = b''
+        while len(out) < n:
+            out += self.randbytes(n - len(out)).translate(DIGIT_TABLE, DIGIT_REJECT)
+        return out.decode()
+
+
+def _after_fork():
+    for pool in list(_pools):
+        pool._reset()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+# This worker's pool
+pool = EntropyPool()
+
+
+def chi_square(counts):
+    """Pearson's statistic against a uniform distribution"""
+    expected = sum(counts) / len(counts)
+    return sum((c - expected) ** 2 / expected for c in counts)
+
+
+def main():
+    from plan import new_plan
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    # Uniformity: 99.9% critical values of chi-square with 9 and 1 dof
+    digits = pool.digits(200000)
+    digit_stat = chi_square([digits.count(str(d)) for d in range(10)])
+    ones = bin(pool.getrandbits(200000)).count('1')
+    coin_stat = chi_square([ones, 200000 - ones])
+    print(f"digits: chi-square {digit_stat:.2f} ({'ok' if digit_stat < 27.88 else 'BIASED'}); "
+          f"coin flips: chi-square {coin_stat:.2f} ({'ok' if coin_stat < 10.83 else 'BIASED'})")
+
+    # Cost per password, against the Mersenne Twister
+    for label, rng in (('random (Mersenne Twister)', random.Random()), ('EntropyPool (os.urandom)', pool)):
+        start = time.perf_counter()
+        for _ in range(count):
+            new_plan(rng)
+        print(f"{label:<26} {(time.perf_counter() - start) / count * 1e6:6.1f} us per plan")
+
+    sys.exit(0 if digit_stat < 27.88 and coin_stat < 10.83 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Deterministic stand-in for the ffmpeg binary, for load tests
+
+Takes any ffmpeg command line the app builds, drains stdin, spends a fixed
+amount of wall time and CPU time, and writes output derived only from its
+input and arguments. The same call always produces the same bytes after the
+same delay, so runs on machines without ffmpeg are repeatable:
+
+* FAKE_FFMPEG_LATENCY: seconds slept per call (default 0.05)
+* FAKE_FFMPEG_CPU: CPU seconds burned per call (default 0.05)
+* FAKE_FFMPEG_FRAME_CPU: CPU seconds burned per rawvideo frame read from
+  stdin (default 0), so cost scales with video length like the real thing
+* FAKE_FFMPEG_FAIL: fraction of calls that exit 1 (default 0), chosen by a
+  hash of the input, so the same inputs always fail
+
+The output (the last argument; pipe:1 or - for stdout) is a small file
+starting with an ftyp box, followed by the SHA-256 of the input and the
+other arguments. install() puts it first on PATH as `ffmpeg`:
+
+    fake_ffmpeg.install(directory, latency=0.2, cpu=0.1)
+    python fake_ffmpeg.py -version
+"""
+import hashlib
+import os
+import shlex
+import stat
+import sys
+import time
+
+# Seconds slept per call
+LATENCY = float(os.environ.get('FAKE_FFMPEG_LATENCY', 0.05))
+
+# CPU seconds burned per call, and per rawvideo frame read from stdin
+CPU = float(os.environ.get('FAKE_FFMPEG_CPU', 0.05))
+FRAME_CPU = float(os.environ.get('FAKE_FFMPEG_FRAME_CPU', 0))
+
+# Fraction of calls that fail
+FAIL = float(os.environ.get('FAKE_FFMPEG_FAIL', 0))
+
+# Written first to every output, so it looks enough like an MP4 to sniff
+HEADER = b'\x00\x00\x00\x14ftypisom\x00\x00\x02\x00isom'
+
+SHIM = """#!/bin/sh
+exec {python} -S {script} "$@"
+"""
+
+
+def burn(seconds):
+    """Busy-loop until this process has used `seconds` more CPU time"""
+    end = time.process_time() + seconds
+    digest = b''
+    while time.process_time() < end:
+        for _ in range(1000):
+            digest = hashlib.sha256(digest).digest()
+
+
+def frame_size(args):
+    """Bytes per rawvideo frame from -s WxH (gray8), or None"""
+    if 'rawvideo' not in args or '-s' not in args:
+        return None
+    width, _, height = args[args.index('-s') + 1].partition('x')
+    return int(width) * int(height)
+
+
+def run(args):
+    if not args or args[0] in ('-version', '-h', '-help'):
+        sys.stdout.write('ffmpeg version fake (fake_ffmpeg.py)\n')
+        return 0
+
+    digest = hashlib.sha256('\0'.join(args[:-1]).encode())  # not the output path
+    read = 0
+    if 'pipe:0' in args or '-' in args[:-1]:
+        while True:
+            chunk = sys.stdin.buffer.read(1 << 16)
+            if not chunk:
+                break
+            digest.update(chunk)
+            read += len(chunk)
+
+    size = frame_size(args)
+    frames = read // size if size else 0
+    time.sleep(LATENCY)
+    burn(CPU + FRAME_CPU * frames)
+
+    result = digest.digest()
+    if FAIL > 0 and int.from_bytes(result[:4], 'big') < FAIL * 2 ** 32:
+        sys.stderr.write('fake_ffmpeg: simulated encoder failure\n')
+        return 1
+
+    output = args[-1]
+    data = HEADER + result
+    if output in ('pipe:1', '-'):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    else:
+        with open(output, 'wb') as f:
+            f.write(data)
+    return 0
+
+
+def install(directory, latency=None, cpu=None, frame_cpu=None, fail=None, env=os.environ):
+    """Put an `ffmpeg` running this script first on env's PATH
+
+    Settings given here are exported to env (the current process by default)
+    for every later call to inherit.
+    """
+    path = os.path.join(directory, 'ffmpeg')
+    with open(path, 'w') as f:
+        f.write(SHIM.format(python=shlex.quote(sys.executable),
+                            script=shlex.quote(os.path.abspath(__file__))))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH)
+    env['PATH'] = directory + os.pathsep + env.get('PATH', '')
+    for name, value in (('LATENCY', latency), ('CPU', cpu), ('FRAME_CPU', frame_cpu), ('FAIL', fail)):
+        if value is not None:
+            env['FAKE_FFMPEG_' + name] = str(value)
+    return path
+
+
+def main():
+    sys.exit(run(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
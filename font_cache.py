@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Process-wide font registry and glyph cache for frame rendering"""
+import threading
+from collections import namedtuple
+from PIL import ImageColor, ImageFont
+
+# Fonts to try, in order, before falling back to PIL's built-in bitmap font
+FONT_CANDIDATES = (
+    "/System/Library/Fonts/Monaco.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+)
+
+# A rasterized piece of text: the coverage mask, its offset from the draw
+# origin, and the width textbbox() would report for centering
+GlyphRun = namedtuple('GlyphRun', ['mask', 'offset', 'width'])
+
+
+class FontRegistry:
+    """Load each (font path, size) once and cache the bitmaps drawn with it"""
+
+    def __init__(self, candidates=FONT_CANDIDATES):
+        self.candidates = tuple(candidates)
+        self._lock = threading.Lock()
+        self._fonts = {}      # (path, size) -> font
+        self._resolved = {}   # size -> font after walking the fallback chain
+        self._runs = {}       # (size, text) -> GlyphRun
+        self.font_hits = 0
+        self.font_misses = 0
+        self.glyph_hits = 0
+        self.glyph_misses = 0
+
+    def load(self, path, size):
+        """Load a TrueType font, parsing the file only the first time"""
+        key = (path, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self.font_hits += 1
+                return font
+            self.font_misses += 1
+        font = ImageFont.truetype(path, size)
+        with self._lock:
+            return self._fonts.setdefault(key, font)
+
+    def font(self, size):
+        """Return the first available candidate font at this size"""
+        font = self._resolved.get(size)
+        if font is not None:
+            with self._lock:
+                self.font_hits += 1
+            return font
+        for path in self.candidates:
+            try:
+                font = self.load(path, size)
+                break
+            except OSError:
+                continue
+        else:
+            font = ImageFont.load_default()
+        with self._lock:
+            return self._resolved.setdefault(size, font)
+
+    def glyph_run(self, text, size):
+        """Return the cached bitmap for a run of text at this size"""
+        key = (size, text)
+        run = self._runs.get(key)
+        if run is not None:
+            with self._lock:
+                self.glyph_hits += 1
+            return run
+
+        font = self.font(size)
+        # Same calls ImageDraw.text/textbbox make on an RGB image, so pasting
+        # the mask reproduces draw.text() pixel for pixel
+        bbox = font.getbbox(text, "L")
+        if hasattr(font, 'getmask2'):
+            mask, offset = font.getmask2(text, "L", start=(0.0, 0.0))
+        else:
+            mask, offset = font.getmask(text, "L"), (0, 0)
+        run = GlyphRun(mask, offset, bbox[2] - bbox[0])
+        with self._lock:
+            self.glyph_misses += 1
+            return self._runs.setdefault(key, run)
+
+    def text_width(self, text, size):
+        """Width of a line of text, as used to center it"""
+        return self.glyph_run(text, size).width
+
+    def draw_text(self, img, xy, text, size, fill='white'):
+        """Blit a cached run onto img; equivalent to ImageDraw.text()"""
+        run = self.glyph_run(text, size)
+        x = int(xy[0]) + run.offset[0]
+        y = int(xy[1]) + run.offset[1]
+        w, h = run.mask.size
+        if w and h:
+            ink = ImageColor.getcolor(fill, img.mode) if isinstance(fill, str) else fill
+            img.im.paste(ink, (x, y, x + w, y + h), run.mask)
+
+    def stats(self):
+        """Hit/miss counters and cache sizes"""
+        with self._lock:
+            return {
+                'font_hits': self.font_hits,
+                'font_misses': self.font_misses,
+                'fonts_loaded': len(self._fonts),
+                'glyph_hits': self.glyph_hits,
+                'glyph_misses': self.glyph_misses,
+                'glyphs_cached': len(self._runs),
+            }
+
+    def clear(self):
+        """Drop every cached font and bitmap and reset the counters"""
+        with self._lock:
+            self._fonts.clear()
+            self._resolved.clear()
+            self._runs.clear()
+            self.font_hits = self.font_misses = 0
+            self.glyph_hits = self.glyph_misses = 0
+
+
+# One registry per worker process
+registry = FontRegistry()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Frame composition from pre-rendered line sprites
+
+Every step frame is a handful of centered lines taken from a small set of
+templates, so each distinct line is rendered once into a full-width band and
+frames are assembled by stacking bands at fixed y offsets. The result is
+pixel-identical to create_text_image().
+"""
+import threading
+from PIL import Image
+from font_cache import registry as default_fonts
+from plan import PRELOAD_STEPS, template_lines  # importable from here too
+
+
+class FrameAtlas:
+    """Cache of rendered line bands plus the layout used to stack them"""
+
+    def __init__(self, width=800, height=600, font_size=48, top=100,
+                 line_gap=20, skip_blank=True, fonts=default_fonts):
+        self.width = width
+        self.height = height
+        self.font_size = font_size
+        self.top = top
+        self.line_height = font_size + line_gap
+        self.skip_blank = skip_blank
+        self.fonts = fonts
+        self._lock = threading.Lock()
+        self._bands = {}  # line -> band bytes, or None if it can't be stacked
+        self._blank = memoryview(bytes(width * height))
+        self.hits = 0
+        self.misses = 0
+
+    def _render_band(self, line):
+        """Render one centered line into a width x line_height grayscale band"""
+        run = self.fonts.glyph_run(line, self.font_size)
+        x = (self.width - run.width) // 2
+        # Bands are full-width, so lines wider than the frame are clipped
+        # exactly as before; glyphs spilling above or below the band would be
+        # clipped by stacking, so frames with such a line are drawn directly
+        top = run.offset[1]
+        if top < 0 or top + run.mask.size[1] > self.line_height:
+            return None
+        band = Image.new('L', (self.width, self.line_height), color=0)
+        self.fonts.draw_text(band, (x, 0), line, self.font_size, fill=255)
+        return memoryview(band.tobytes())
+
+    def band(self, line):
+        """Return the band for a line, rendering it on first use"""
+        try:
+            band = self._bands[line]
+            self.hits += 1
+            return band
+        except KeyError:
+            pass
+        band = self._render_band(line)
+        with self._lock:
+            self.misses += 1
+            return self._bands.setdefault(line, band)
+
+    def preload(self, lines):
+        """Render a set of lines ahead of the first request"""
+        for line in lines:
+            self.band(line)
+        return self
+
+    def _lines(self, text):
+        lines = text.split('\n')
+        if self.skip_blank:
+            lines = [line for line in lines if line.strip()]
+        return lines
+
+    def render_gray(self, text):
+        """Compose a frame for text as a grayscale ('L') image"""
+        lines = self._lines(text)
+        bands = [self.band(line) for line in lines]
+        if None in bands:
+            img = Image.new('L', (self.width, self.height), color=0)
+            y_offset = self.top
+            for line in lines:
+                x = (self.width - self.fonts.text_width(line, self.font_size)) // 2
+                self.fonts.draw_text(img, (x, y_offset), line, self.font_size, fill=255)
+                y_offset += self.line_height
+            return img
+
+        # Bands are full-width rows, so a frame is just blank rows above,
+        # the bands back to back, and blank rows below
+        size = self.width * self.height
+        used = min(self.top, self.height) * self.width
+        pieces = [self._blank[:used]]
+        for band in bands:
+            if used + len(band) > size:
+                band = band[:size - used]
+            pieces.append(band)
+            used += len(band)
+        pieces.append(self._blank[used:])
+        return Image.frombytes('L', (self.width, self.height), b''.join(pieces))
+
+    def render(self, text):
+        """Compose a frame for text; same output as create_text_image()"""
+        return self.render_gray(text).convert('RGB')
+
+    def stats(self):
+        """Band counts and hit/miss counters"""
+        with self._lock:
+            return {
+                'bands': len(self._bands),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,38 @@
+"""gunicorn settings, read from the working directory on start-up
+
+With preloading on (the default; GUNICORN_PRELOAD=0 turns it off) the app is
+imported once in the master and warmed there: PIL and the fonts, the line
+atlas, the encoder probes and the page template. Its objects are then moved
+out of the garbage collector's reach, and forked workers share those pages
+copy-on-write instead of each building their own. Without preloading every
+worker imports and warms the app itself after it is forked.
+
+Threads don't survive fork, so background threads start in each worker.
+
+    python bench_startup.py   # import time and per-worker memory, both ways
+"""
+import gc
+import os
+import sys
+
+# Import and warm the app in the master, before forking workers
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def _app_module(server):
+    """The module holding the WSGI app (application.py or app.py)"""
+    return sys.modules[server.app.wsgi().import_name]
+
+
+def when_ready(server):
+    if preload_app:
+        _app_module(server).warm()
+        # Collections would touch (and so copy) every warmed object
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    module = _app_module(server)
+    if not preload_app:
+        module.warm()
+    module.start_background()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Background job queue for video generation
+
+POST /generate enqueues a job and returns its id straight away; a bounded
+pool of worker threads does the rendering and encoding (the heavy lifting
+happens in ffmpeg, outside the GIL) and clients poll /jobs/<id> for status
+and per-frame progress. A job whose client stops polling is cancelled, and
+so is one its client cancels with DELETE /jobs/<id>; the two are reported
+with different errors.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import Cancelled, Withdrawn
+from metrics import Timings
+
+# Concurrent generation jobs per process
+MAX_WORKERS = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))
+
+# How long finished jobs stay around for polling
+JOB_TTL = int(os.environ.get('JOB_TTL', 3600))
+
+# A watched job nobody has polled for this many seconds is cancelled; the
+# page polls every 500ms, so this only trips once the client is gone
+ABANDON_AFTER = float(os.environ.get('JOB_ABANDON_AFTER', 30))
+
+QUEUED = 'queued'
+RENDERING = 'rendering'
+ENCODING = 'encoding'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job:
+    """State and progress of one generation request"""
+
+    def __init__(self):
+        self.id = str(uuid.uuid4())
+        self.status = QUEUED
+        self.frames_done = 0
+        self.frames_total = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.timings = Timings()
+        self.last_seen = None  # set for jobs a client polls; see seen()
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def start(self, frames_total, status=RENDERING):
+        """Record the frame count once the plan is known"""
+        with self._lock:
+            self.frames_total = frames_total
+            self.status = status
+
+    def seen(self):
+        """Note that the client is still polling"""
+        self.last_seen = time.monotonic()
+
+    def cancel(self):
+        self._cancelled = True
+
+    def cancelled(self):
+        """True once its client stopped polling; raises Withdrawn if cancelled
+
+        The check admission and advance() run: an explicit cancel stops the
+        job with its own error, not as a client that went away.
+        """
+        if self._cancelled:
+            raise Withdrawn('Cancelled by the client')
+        return self.last_seen is not None and time.monotonic() - self.last_seen > ABANDON_AFTER
+
+    def advance(self, frames=1):
+        """Count rendered frames; moves to encoding after the last one
+
+        Raises Cancelled (Withdrawn if cancelled explicitly) once the job has
+        been cancelled, which stops the encode it is reporting progress for.
+        """
+        if self.cancelled():
+            raise Cancelled('Client stopped polling')
+        with self._lock:
+            self.frames_done = min(self.frames_done + frames, self.frames_total)
+            if self.frames_done == self.frames_total:
+                self.status = ENCODING
+
+    def to_dict(self):
+        """Status as returned by /jobs/<id>"""
+        with self._lock:
+            data = {
+                'job_id': self.id,
+                'status': self.status,
+                'progress': {
+                    'frames_done': self.frames_done,
+                    'frames_total': self.frames_total,
+                },
+            }
+            if self.status == DONE:
+                data.update(self.result)
+            elif self.status in (FAILED, CANCELLED):
+                data['error'] = self.error
+            return data
+
+
+class JobQueue:
+    """Runs jobs on a bounded thread pool and keeps them for polling"""
+
+    def __init__(self, max_workers=MAX_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='generate')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn):
+        """Queue fn(job); its return value becomes the job's result"""
+        self._prune()
+        job = Job()
+        job.seen()
+        with self._lock:
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, fn)
+        return job
+
+    def add_finished(self, result, frames_total=0):
+        """Record a job whose result was ready up front (e.g. from a pool)"""
+        self._prune()
+        job = Job()
+        job.status = DONE
+        job.result = result
+        job.frames_total = job.frames_done = frames_total
+        job.finished = time.time()
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        """Look up a job, or None if it is unknown or expired"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait=True):
+        """Stop taking jobs; with wait, return once running ones finish"""
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, job, fn):
+        try:
+            result = fn(job)
+        except Cancelled as e:
+            with job._lock:
+                job.status = CANCELLED
+                job.error = str(e)
+                job.finished = time.time()
+        except Exception as e:
+            with job._lock:
+                job.status = FAILED
+                job.error = str(e)
+                job.finished = time.time()
+        else:
+            with job._lock:
+                job.status = DONE
+                job.result = result
+                job.frames_done = job.frames_total
+                job.finished = time.time()
+
+    def _prune(self):
+        """Forget finished jobs older than the TTL"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self):
+        """Number of jobs in each state"""
+        counts = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
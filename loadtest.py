@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Load test: N concurrent clients driving /generate end to end
+
+Each client loops: POST /generate, poll the job until it finishes, then
+download the video (the `video` scenario), or just ask for a plan (`plan`).
+It runs for a number of iterations (-n) or seconds (-d), then reports
+throughput, latency percentiles of successful iterations, the share of
+each outcome (ok, http_429, failed, timeout, ...) and the server's CPU use.
+
+Targets:
+
+* in-process (default): the app's WSGI test client, one per client thread;
+  CPU is this process plus its reaped children (ffmpeg), so it includes the
+  clients' own overhead
+* --gunicorn WxT: starts gunicorn here with W workers of T threads and
+  drives it over HTTP; CPU is the master and workers plus their children.
+  Jobs live in the worker that created them, so with more than one worker
+  polls that land elsewhere show up as http_404
+* --url URL: an already running server over HTTP; CPU is only reported
+  with --server-pid (its master's pid)
+
+Without ffmpeg on PATH, or with --fake-ffmpeg, fake_ffmpeg.py stands in for
+it with a fixed latency and CPU cost per call (MP4s then go through the
+binary, not PyAV), so results depend on the app rather than the encoder.
+Videos go to a temporary store, removed afterwards.
+
+    python loadtest.py -c 16 -d 30
+    python loadtest.py -c 64 -n 1000 --gunicorn 2x16 --fake-ffmpeg --ffmpeg-cpu 0.2
+    python loadtest.py -c 32 -d 60 --url http://127.0.0.1:8080 --json run.json
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from bench_startup import children, free_port
+from benchmark import percentile
+
+# How long a started gunicorn may take to answer
+SERVER_START_TIMEOUT = 60
+
+
+class WSGIClient:
+    """Requests through Flask's test client, in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, timeout=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.headers, response.get_data()
+
+
+class HTTPClient:
+    """Requests over HTTP with urllib"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, timeout=None):
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+
+class Rejected(Exception):
+    """The server answered 429 (or 503) and asked the client to back off"""
+
+    def __init__(self, status, headers):
+        super().__init__(f'http_{status}')
+        try:
+            self.retry_after = float(headers.get('Retry-After', 1))
+        except ValueError:
+            self.retry_after = 1.0
+
+
+def check(status, headers, ok=(200,)):
+    """None if status is in ok; otherwise the outcome to record"""
+    if status in ok:
+        return None
+    if status in (429, 503):
+        raise Rejected(status, headers)
+    return f'http_{status}'
+
+
+def video_scenario(client, deadline, options, poll, fetch):
+    """Generate a video, wait for its job, download it; the outcome"""
+    status, headers, body = client.request('POST', '/generate', options,
+                                           timeout=deadline - time.monotonic())
+    # 202 for a queued job, 200 for one answered from the pool
+    failure = check(status, headers, ok=(200, 202))
+    if failure:
+        return failure
+    job = json.loads(body)
+    status_url = job['status_url']
+    while job.get('status', 'queued') not in ('done', 'failed', 'cancelled'):
+        if time.monotonic() + poll >= deadline:
+            # Free the server's slot rather than leaving the job to expire
+            client.request('DELETE', status_url, timeout=poll + 1)
+            return 'timeout'
+        time.sleep(poll)
+        status, headers, body = client.request('GET', status_url,
+                                               timeout=deadline - time.monotonic())
+        failure = check(status, headers)
+        if failure:
+            return failure
+        job = json.loads(body)
+    if job['status'] != 'done':
+        return job['status']
+    if fetch:
+        status, headers, _ = client.request('GET', job['video_url'],
+                                            timeout=deadline - time.monotonic())
+        return check(status, headers) or 'ok'
+    return 'ok'
+
+
+def plan_scenario(client, deadline, options, poll, fetch):
+    """Ask for a plan only (no video); the outcome"""
+    status, headers, _ = client.request('POST', '/generate', dict(options, mode='plan'),
+                                        timeout=deadline - time.monotonic())
+    return check(status, headers) or 'ok'
+
+
+SCENARIOS = {'video': video_scenario, 'plan': plan_scenario}
+
+
+def run_load(make_client, scenario, concurrency, requests=None, duration=None, timeout=60,
+             backoff=True, **options):
+    """Drive scenario from concurrency threads; (elapsed, [(latency, outcome)])
+
+    A client turned away with 429/503 waits out Retry-After before its next
+    iteration when backoff is on, as a well-behaved client would.
+    """
+    results = []
+    tickets = itertools.count()
+    start = time.monotonic()
+    stop_at = None if requests else start + duration
+
+    def client_loop():
+        client = make_client()
+        while True:
+            if requests:
+                if next(tickets) >= requests:
+                    return
+            elif time.monotonic() >= stop_at:
+                return
+            began = time.monotonic()
+            pause = 0
+            try:
+                outcome = scenario(client, began + timeout, **options)
+            except Rejected as e:
+                outcome = str(e)
+                pause = e.retry_after if backoff else 0
+            except (socket.timeout, TimeoutError):
+                outcome = 'timeout'
+            except urllib.error.URLError as e:
+                timed_out = isinstance(e.reason, (socket.timeout, TimeoutError))
+                outcome = 'timeout' if timed_out else 'error:' + type(e.reason).__name__
+            except Exception as e:
+                outcome = 'error:' + type(e).__name__
+            results.append((time.monotonic() - began, outcome))
+            if pause:
+                time.sleep(pause if requests else min(pause, max(0, stop_at - time.monotonic())))
+
+    threads = [threading.Thread(target=client_loop, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - start, results
+
+
+def process_cpu(pid):
+    """CPU seconds used by a process and its reaped children (Linux /proc)"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rpartition(')')[2].split()
+    # utime, stime, cutime, cstime (fields 14-17 of stat)
+    return sum(int(value) for value in fields[11:15]) / os.sysconf('SC_CLK_TCK')
+
+
+def server_cpu(pid):
+    """CPU seconds of a server's master, its workers and their children"""
+    total = 0.0
+    for process in [pid] + children(pid):
+        try:
+            total += process_cpu(process)
+        except OSError:
+            pass  # a worker exited in between
+    return total
+
+
+def own_cpu():
+    """CPU seconds of this process and its reaped children"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def start_gunicorn(spec, env):
+    """Start gunicorn for application.py; (process, base URL) once it answers"""
+    workers, _, threads = spec.partition('x')
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', workers or '1', '--threads', threads or '1',
+         '--bind', f'127.0.0.1:{port}', 'application:application'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    started = time.monotonic()
+    while True:
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=1).read()
+            return server, base_url
+        except OSError:
+            if time.monotonic() - started > SERVER_START_TIMEOUT or server.poll() is not None:
+                stop_server(server)
+                raise RuntimeError('gunicorn did not start')
+            time.sleep(0.1)
+
+
+def stop_server(server):
+    if server.poll() is None:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def summarize(elapsed, results, cpu_seconds):
+    outcomes = {}
+    for _, outcome in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    ok = sorted(latency * 1000 for latency, outcome in results if outcome == 'ok')
+    total = len(results)
+    return {
+        'iterations': total,
+        'seconds': elapsed,
+        'throughput': total / elapsed if elapsed else 0.0,
+        'ok_throughput': len(ok) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'mean': sum(ok) / len(ok) if ok else 0.0,
+            'p50': percentile(ok, 50),
+            'p90': percentile(ok, 90),
+            'p99': percentile(ok, 99),
+            'max': ok[-1] if ok else 0.0,
+        },
+        'outcomes': {name: {'count': count, 'rate': count / total}
+                     for name, count in sorted(outcomes.items(), key=lambda item: -item[1])},
+        'cpu': None if cpu_seconds is None else {
+            'seconds': cpu_seconds,
+            'cores': cpu_seconds / elapsed if elapsed else 0.0,
+            'ms_per_ok': cpu_seconds / len(ok) * 1000 if ok else 0.0,
+        },
+    }
+
+
+def report(summary):
+    latency = summary['latency_ms']
+    print(f"{summary['iterations']} iterations in {summary['seconds']:.1f} s: "
+          f"{summary['throughput']:.2f}/s, {summary['ok_throughput']:.2f} ok/s")
+    print(f"latency (ok) p50 {latency['p50']:.1f} ms  p90 {latency['p90']:.1f} ms  "
+          f"p99 {latency['p99']:.1f} ms  max {latency['max']:.1f} ms")
+    print('outcomes: ' + ', '.join(f"{name} {stats['count']} ({stats['rate']:.1%})"
+                                   for name, stats in summary['outcomes'].items()))
+    cpu = summary['cpu']
+    if cpu is None:
+        print('server CPU: not measured (pass --server-pid)')
+    else:
+        print(f"server CPU: {cpu['seconds']:.1f} s, {cpu['cores']:.2f} cores busy, "
+              f"{cpu['ms_per_ok']:.1f} ms per ok iteration")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /generate with concurrent clients")
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('-n', '--requests', type=int, help='total iterations (default: run for -d)')
+    parser.add_argument('-d', '--duration', type=float, default=30.0, help='seconds to run')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='video')
+    parser.add_argument('--format', help='video format to request (default: the server default)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds per iteration')
+    parser.add_argument('--poll', type=float, default=0.05, help='seconds between job polls')
+    parser.add_argument('--no-fetch', action='store_true', help="don't download finished videos")
+    parser.add_argument('--no-backoff', action='store_true',
+                        help='retry at once after 429/503 instead of waiting out Retry-After')
+    server_group = parser.add_mutually_exclusive_group()
+    server_group.add_argument('--gunicorn', metavar='WxT', help='start gunicorn with W workers of T threads')
+    server_group.add_argument('--url', help='drive a running server at this base URL')
+    parser.add_argument('--server-pid', type=int, help='master pid of the --url server, for CPU')
+    parser.add_argument('--fake-ffmpeg', action='store_true', help='use fake_ffmpeg.py as ffmpeg')
+    parser.add_argument('--ffmpeg-latency', type=float, help='fake ffmpeg: seconds slept per call')
+    parser.add_argument('--ffmpeg-cpu', type=float, help='fake ffmpeg: CPU seconds per call')
+    parser.add_argument('--ffmpeg-frame-cpu', type=float, help='fake ffmpeg: CPU seconds per frame')
+    parser.add_argument('--ffmpeg-fail', type=float, help='fake ffmpeg: fraction of calls failing')
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='loadtest_')
+    server = None
+    try:
+        env = os.environ
+        if args.gunicorn:
+            env = dict(os.environ)
+        env.setdefault('VIDEO_STORE_DIR', os.path.join(work_dir, 'videos'))
+        fake = args.fake_ffmpeg or shutil.which('ffmpeg') is None
+        if fake and not args.url:
+            import fake_ffmpeg
+            fake_ffmpeg.install(work_dir, latency=args.ffmpeg_latency, cpu=args.ffmpeg_cpu,
+                                frame_cpu=args.ffmpeg_frame_cpu, fail=args.ffmpeg_fail, env=env)
+            env['MP4_BACKEND'] = 'ffmpeg'  # PyAV would bypass the binary
+
+        if args.url:
+            base_url, pid = args.url, args.server_pid
+        elif args.gunicorn:
+            server, base_url = start_gunicorn(args.gunicorn, env)
+            pid = server.pid
+        if args.url or args.gunicorn:
+            make_client = lambda: HTTPClient(base_url)
+            measure_cpu = (lambda: server_cpu(pid)) if pid else None
+            target = base_url
+        else:
+            import application
+            application.warm()
+            application.start_background()
+            make_client = lambda: WSGIClient(application.application)
+            measure_cpu = own_cpu
+            target = 'in-process'
+
+        options = {'format': args.format} if args.format else {}
+        print(f"{args.scenario} x {args.concurrency} clients against {target}"
+              f"{' (fake ffmpeg)' if fake and not args.url else ''}")
+        cpu_before = measure_cpu() if measure_cpu else None
+        elapsed, results = run_load(
+            make_client, SCENARIOS[args.scenario], args.concurrency, args.requests, args.duration,
+            args.timeout, backoff=not args.no_backoff, options=options, poll=args.poll,
+            fetch=not args.no_fetch)
+        cpu = measure_cpu() - cpu_before if measure_cpu else None
+
+        summary = summarize(elapsed, results, cpu)
+        summary['config'] = {
+            'target': target,
+            'scenario': args.scenario,
+            'concurrency': args.concurrency,
+            'fake_ffmpeg': fake and not args.url,
+        }
+        report(summary)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(summary, f, indent=2)
+        sys.exit(0 if 'ok' in summary['outcomes'] else 1)
+    finally:
+        if server is not None:
+            stop_server(server)
+        elif 'application' in sys.modules:
+            # Let jobs still encoding (timed out, or cancelled) finish first
+            sys.modules['application'].jobs.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
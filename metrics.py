@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Per-stage timings and Prometheus-style metrics for video generation
+
+Each generation job carries a Timings object that the pipeline adds stage
+durations to (plan, render, save, encode, move, cleanup). When the job
+finishes they are folded into process-wide histograms and counters, which
+/metrics serves in the Prometheus text format. Observations are a bisect and
+a couple of additions under a lock, so this stays on all the time.
+
+Metrics are per process; with more than one gunicorn worker each scrape only
+sees the worker that answered it.
+"""
+import bisect
+import threading
+import time
+
+# Stage names, in pipeline order
+STAGES = ('plan', 'render', 'save', 'encode', 'move', 'cleanup')
+
+# Histogram buckets (seconds) for stage durations
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Histogram buckets (seconds) for time spent waiting for an encode slot
+QUEUE_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Frames per video are 2L-4 steps plus the completion frame, L = 10..15
+FRAME_BUCKETS = (17, 19, 21, 23, 25, 27, 30, 40)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Monotonic count, optionally split by one label"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value=None, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value=None):
+        with self._lock:
+            return self._values.get(label_value, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: str(item[0]))
+        for label_value, value in items:
+            pairs = [(self.label, label_value)] if self.label else []
+            yield self.name, pairs, value
+
+
+class Gauge:
+    """Value read when metrics are collected
+
+    fn returns a number, or a dict of label value -> number when the gauge
+    has a label. kind='counter' exposes a count kept elsewhere (e.g. in a
+    component's stats()) as a counter.
+    """
+
+    def __init__(self, name, help, fn, label=None, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        values = self.fn()
+        if self.label:
+            for label_value, value in sorted(values.items()):
+                yield self.name, [(self.label, label_value)], value
+        else:
+            yield self.name, [], values
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by one label"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, label_value=None):
+        with self._lock:
+            series = self._series.get(label_value)
+            return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, ([*series[0]], series[1], series[2]))
+                           for key, series in self._series.items())
+        for label_value, (counts, total, count) in items:
+            base = [(self.label, label_value)] if self.label else []
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', base + [('le', _format_value(bound))], cumulative
+            yield self.name + '_sum', base, total
+            yield self.name + '_count', base, count
+
+
+class Registry:
+    """Collection of metrics rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label=None):
+        return self.register(Counter(name, help, label))
+
+    def gauge(self, name, help, fn, label=None, kind='gauge'):
+        return self.register(Gauge(name, help, fn, label, kind))
+
+    def histogram(self, name, help, buckets, label=None):
+        return self.register(Histogram(name, help, buckets, label))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, pairs, value in metric.samples():
+                lines.append(f'{name}{_labels(pairs)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'password_stage_seconds', 'Time spent in each video generation stage',
+    STAGE_BUCKETS, label='stage')
+FRAMES_PER_VIDEO = registry.histogram(
+    'password_video_frames', 'Frames in each generated video', FRAME_BUCKETS)
+ENCODER_FAILURES = registry.counter(
+    'password_encoder_failures_total', 'ffmpeg failures; fallback means the PNG path recovered',
+    label='outcome')
+BYTES_WRITTEN = registry.counter(
+    'password_video_bytes_total', 'Bytes of video published to the video store')
+QUEUE_WAIT = registry.histogram(
+    'password_encode_queue_wait_seconds', 'Time admitted encodes waited for a slot',
+    QUEUE_BUCKETS)
+
+
+class Timings:
+    """Stage durations of one job, in seconds"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def stage(self, name):
+        """Context manager timing a block into the named stage"""
+        return _StageTimer(self, name)
+
+    def header(self):
+        """Server-Timing header value, durations in milliseconds"""
+        return ', '.join(f'{stage};dur={self.stages[stage] * 1000:.1f}'
+                         for stage in STAGES if stage in self.stages)
+
+    def observe(self):
+        """Fold these timings into the stage histograms"""
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage)
+
+
+class _StageTimer:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+        return False
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Password step plans as compact op-code sequences
+
+A plan is the random digit string, the 4 target positions, and the walk
+through it: one signed byte per step, either the digit entered (0-9) or
+DELETE, plus the digits left on screen after each step. Turning a plan into
+text, frames, JSON or video is a separate step that only runs when needed.
+
+Randomness comes from entropy.pool (buffered os.urandom) unless an rng is
+passed; any random.Random works, e.g. a seeded one for reproducible plans.
+
+    python plan.py   # check PLAN_MAX_STEPS parsing and that plans obey the cap
+"""
+import os
+import random
+import sys
+from array import array
+from entropy import pool
+
+# Op code for "Delete 1 digit from the right"; 0-9 mean "enter this digit"
+DELETE = -1
+
+COMPLETION_LINE = "🎉 PASSWORD COMPLETE!"
+
+# Each step is on screen for this long, in videos and in the browser player
+FRAME_SECONDS = 10
+
+# A plan enters every digit of its 10-15 digit string once and deletes all
+# but the 4 password digits, so it has exactly 2 * length - 4 steps (see
+# step_model.py)
+MIN_STEPS = 2 * 10 - 4
+MAX_STEPS = 2 * 15 - 4
+
+# Highest step number whose lines are rendered ahead of time (see
+# template_lines): the longest plan there is, so no line is left to render lazily
+PRELOAD_STEPS = MAX_STEPS
+
+
+
+def parse_max_steps(value):
+    """PLAN_MAX_STEPS as an int, or None if unset; ValueError if unusable"""
+    if not value:
+        return None
+    try:
+        max_steps = int(value)
+    except ValueError:
+        max_steps = None
+    if max_steps is None or max_steps < MIN_STEPS:
+        raise ValueError(f"PLAN_MAX_STEPS must be a whole number of at least "
+                         f"{MIN_STEPS} (the shortest plan there is), got {value!r}")
+    return max_steps
+
+
+# Optional cap on steps per plan (PLAN_MAX_STEPS), bounding video length;
+# checked here so a bad value stops start-up instead of failing every request
+PLAN_MAX_STEPS = parse_max_steps(os.environ.get('PLAN_MAX_STEPS'))
+
+
+def generate_random_string(length, rng=pool):
+    """Generate a random string of digits"""
+    digits = getattr(rng, 'digits', None)  # EntropyPool does it in one go
+    if digits is not None:
+        return digits(length)
+    return ''.join([str(rng.randint(0, 9)) for _ in range(length)])
+
+
+def pick_target_indices(string_length, rng=pool):
+    """Pick the positions of the 4 password digits in the random string"""
+    # 1st digit: random position in first 2/3
+    first = rng.randint(0, string_length - 6)
+    # 2nd digit: after 1st digit
+    second = rng.randint(first + 1, string_length - 4)
+    # 3rd and 4th digits: 2nd to last and last positions
+    return [first, second, string_length - 2, string_length - 1]
+
+
+def walk(random_string, target_indices, rng=pool):
+    """Run the entry/deletion state machine; returns (ops, on_screen)"""
+    string_length = len(random_string)
+    ops = array('b')
+    on_screen = array('b')
+    digits_on_screen = 0
+    total_digits_typed = 0
+    correct_digits_typed = 0
+    # Coin flips, used from the low bit up; the top set bit marks the end
+    coins = 0
+
+    while correct_digits_typed < 4:
+        # An iteration flips at most twice; refill before running short
+        if coins < 4:
+            coins = rng.getrandbits(62) | 1 << 62
+        # Prevent entering 4th digit unless we're at the last position
+        if digits_on_screen == 3 and total_digits_typed < string_length - 1:
+            enter = False
+        # If we're at a target digit position
+        elif total_digits_typed == target_indices[correct_digits_typed]:
+            # Only type it if it will land in the right spot (rightmost)
+            enter = correct_digits_typed == digits_on_screen
+            if enter:
+                correct_digits_typed += 1
+        else:
+            # Not at a target digit, randomly decide to insert or not
+            enter = coins & 1
+            coins >>= 1
+
+        if enter:
+            ops.append(ord(random_string[total_digits_typed]) - 48)
+            digits_on_screen += 1
+            total_digits_typed += 1
+            on_screen.append(digits_on_screen)
+
+        # Deletion logic: only delete if we have non-target digits on screen
+        if correct_digits_typed < digits_on_screen:
+            delete = coins & 1
+            coins >>= 1
+            if delete:
+                ops.append(DELETE)
+                digits_on_screen -= 1
+                on_screen.append(digits_on_screen)
+
+    return ops, on_screen
+
+
+def step_text(step, op, digits_on_screen):
+    """Frame text for one step"""
+    if op == DELETE:
+        action = "Delete 1 digit from the right"
+    else:
+        action = f"Enter this digit: {op}"
+    return f"--- Step {step} ---\n{action}\nDigits on screen: {digits_on_screen}"
+
+
+def completion_text(completion_line=COMPLETION_LINE):
+    """Frame text shown once the password is complete"""
+    return "=" * 40 + "\n" + completion_line
+
+
+def template_lines(completion_line=COMPLETION_LINE, max_step=PRELOAD_STEPS):
+    """Every distinct line a plan can produce, up to max_step"""
+    lines = set()
+    for step in range(1, max_step + 1):
+        lines.update(step_text(step, DELETE, 0).split('\n'))
+    for digit in range(10):
+        lines.update(step_text(1, digit, 0).split('\n'))
+    for on_screen in range(5):
+        lines.update(step_text(1, DELETE, on_screen).split('\n'))
+    lines.update(completion_text(completion_line).split('\n'))
+    return sorted(lines)
+
+
+class Plan:
+    """One generated password and the steps that enter it"""
+
+    __slots__ = ('random_string', 'target_indices', 'ops', 'on_screen')
+
+    def __init__(self, random_string, target_indices, ops, on_screen):
+        self.random_string = random_string
+        self.target_indices = target_indices
+        self.ops = ops
+        self.on_screen = on_screen
+
+    @property
+    def target_password(self):
+        return ''.join([self.random_string[i] for i in self.target_indices])
+
+    def __len__(self):
+        """Number of steps, not counting the completion frame"""
+        return len(self.ops)
+
+    def key(self):
+        """Compact, hashable identity of the plan"""
+        return (self.random_string, tuple(self.target_indices), self.ops.tobytes())
+
+    def __eq__(self, other):
+        return isinstance(other, Plan) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def iter_steps(self, completion_line=COMPLETION_LINE):
+        """Yield the frame text for each step, then the completion frame"""
+        for i, (op, digits) in enumerate(zip(self.ops, self.on_screen), 1):
+            yield step_text(i, op, digits)
+        yield completion_text(completion_line)
+
+    def steps(self, completion_line=COMPLETION_LINE):
+        """All frame texts as a list"""
+        return list(self.iter_steps(completion_line))
+
+    def to_dict(self):
+        """JSON-friendly form; ops are -1 for delete, otherwise the digit"""
+        return {
+            'target_password': self.target_password,
+            'random_string': self.random_string,
+            'target_indices': list(self.target_indices),
+            'ops': self.ops.tolist(),
+            'on_screen': self.on_screen.tolist(),
+        }
+
+
+def new_plan(rng=pool, max_steps=None):
+    """Generate a fresh random plan, with at most max_steps steps if given
+
+    Longer plans are redrawn, so a bounded plan is distributed like an
+    unbounded one conditioned on its length.
+    """
+    if max_steps is not None and max_steps < MIN_STEPS:
+        raise ValueError(f"Plans have at least {MIN_STEPS} steps")
+    while True:
+        # Generate a long random string (10-15 digits)
+        string_length = rng.randint(10, 15)
+        random_string = generate_random_string(string_length, rng)
+        target_indices = pick_target_indices(string_length, rng)
+        ops, on_screen = walk(random_string, target_indices, rng)
+        if max_steps is None or len(ops) <= max_steps:
+            return Plan(random_string, target_indices, ops, on_screen)
+
+
+def main():
+    failures = 0
+
+    def expect(label, value, wanted):
+        nonlocal failures
+        try:
+            got = parse_max_steps(value)
+        except ValueError:
+            got = ValueError
+        ok = got == wanted
+        failures += not ok
+        print(f"PLAN_MAX_STEPS={value!r:<8} {label:<24}{'' if ok else f'  FAILED (got {got})'}")
+
+    expect('unset', None, None)
+    expect('unset', '', None)
+    expect('the shortest plan', str(MIN_STEPS), MIN_STEPS)
+    expect('the longest plan', str(MAX_STEPS), MAX_STEPS)
+    expect('below the shortest plan', str(MIN_STEPS - 1), ValueError)
+    expect('negative', '-5', ValueError)
+    expect('not a number', 'twenty', ValueError)
+    expect('not a whole number', '20.5', ValueError)
+
+    rng = random.Random(0)
+    for max_steps in range(MIN_STEPS, MAX_STEPS + 1, 2):
+        longest = max(len(new_plan(rng, max_steps)) for _ in range(200))
+        ok = longest <= max_steps
+        failures += not ok
+        print(f"max_steps {max_steps}: longest of 200 plans {longest}{'' if ok else '  FAILED'}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Render and encode the frames of one video across a pool of processes
+
+The pool is created on first use and stays warm across requests; each
+worker process builds its own FrameAtlas (fonts loaded, template lines
+rendered) when it starts. Three kinds of work are spread over it:
+
+* render_files: render frames and save them as PNG files, in order
+* render_pngs: render frames and return them as PNG bytes, in order, for
+  the caller to put in a workspace (see workspace.py)
+* encode: split a video into contiguous chunks, encode each chunk in its
+  own worker (frames piped straight into ffmpeg), then join the chunks with
+  a stream copy. Only frame texts and file paths cross process boundaries.
+"""
+import io
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker processes per pool; 0 or 1 keeps rendering in the calling process
+PROCESSES = int(os.environ.get('RENDER_PROCESSES', 0))
+
+# Don't split a video into chunks shorter than this; every chunk pays for an
+# ffmpeg start-up and an extra keyframe
+MIN_CHUNK_FRAMES = 4
+
+# Per-worker state, set up by _init_worker
+_atlas = None
+
+
+def _init_worker(layout, warm_lines):
+    """Build the worker's atlas once, so every task starts warm"""
+    global _atlas
+    from frame_atlas import FrameAtlas
+    _atlas = FrameAtlas(**layout).preload(warm_lines)
+
+
+def _render_file(text, path):
+    _atlas.render(text).save(path)
+    return path
+
+
+def _render_png(text):
+    buffer = io.BytesIO()
+    _atlas.render(text).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _encode_chunk(texts, path):
+    from video_encoder import encode_pipe
+    encode_pipe(texts, path, _atlas)
+    return len(texts)
+
+
+class RenderPool:
+    """Warm process pool bound to one frame layout"""
+
+    def __init__(self, processes=PROCESSES, layout=None, warm_lines=()):
+        self.processes = processes
+        self.layout = dict(layout or {})
+        self.warm_lines = list(warm_lines)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.processes > 1
+
+    def executor(self):
+        """Start the worker processes on first use"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    initializer=_init_worker,
+                    initargs=(self.layout, self.warm_lines),
+                )
+            return self._executor
+
+    def render_files(self, texts, paths):
+        """Render texts[i] into paths[i] as PNG files"""
+        chunksize = max(1, len(texts) // (self.processes * 4))
+        return list(self.executor().map(_render_file, texts, paths, chunksize=chunksize))
+
+    def render_pngs(self, texts):
+        """Render texts as PNG-encoded bytes, in order"""
+        chunksize = max(1, len(texts) // (self.processes * 4))
+        return self.executor().map(_render_png, texts, chunksize=chunksize)
+
+    def chunks(self, texts):
+        """Split texts into at most one contiguous run per worker"""
+        count = max(1, min(self.processes, len(texts) // MIN_CHUNK_FRAMES))
+        size, extra = divmod(len(texts), count)
+        chunks, start = [], 0
+        for i in range(count):
+            end = start + size + (1 if i < extra else 0)
+            chunks.append(texts[start:end])
+            start = end
+        return chunks
+
+    def encode(self, texts, output, progress=None):
+        """Encode chunks of the video in parallel and join them in order
+
+        progress, if given, is called with the frame count of each finished
+        chunk. If it raises (e.g. admission.Cancelled once the job is
+        cancelled), chunks not yet started are dropped before it propagates.
+        """
+        from video_encoder import concat_copy
+        chunks = self.chunks(list(texts))
+        work_dir = tempfile.mkdtemp(prefix="password_chunks_")
+        try:
+            paths = [os.path.join(work_dir, f"chunk_{i:03d}.mp4") for i in range(len(chunks))]
+            futures = [self.executor().submit(_encode_chunk, chunk, path)
+                       for chunk, path in zip(chunks, paths)]
+            try:
+                for future in futures:
+                    frames = future.result()
+                    if progress:
+                        progress(frames)
+            except BaseException:
+                # Free the workers for other videos; running chunks finish
+                for future in futures:
+                    future.cancel()
+                raise
+            return concat_copy(paths, output)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Pre-encoded per-frame video segments stitched together with stream copy
+
+Every frame of a /generate video is a 10 second still, and only a finite set
+of frames exists (step number x action x digit x digits on screen). Each one
+is encoded once into a single-frame H.264 segment with the same encoder
+settings as the full video; a request then only has to concatenate segments
+with ffmpeg's concat demuxer in -c copy mode.
+
+Build the cache ahead of time with:
+
+    python segment_cache.py build [--max-step N] [--jobs J] [--dir DIR]
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from plan import DELETE, MAX_STEPS, completion_text, step_text
+from video_encoder import ENCODE_ARGS, FRAMERATE, concat_copy
+from workspace import open_workspace
+
+SEGMENT_DIR = os.environ.get('SEGMENT_CACHE_DIR', 'segments')
+
+# Highest step number encoded by the offline build: the longest plan there
+# is, so a full build covers every frame (44 per step plus the completions)
+BUILD_MAX_STEP = MAX_STEPS
+
+COMPLETION_LINES = ("🎉 PASSWORD COMPLETE!", "PASSWORD COMPLETE!")
+
+
+def frame_texts(max_step=BUILD_MAX_STEP, completion_lines=COMPLETION_LINES):
+    """Every frame text a plan can produce up to max_step"""
+    texts = []
+    for step in range(1, max_step + 1):
+        for digit in range(10):
+            # Entering a digit leaves 1-4 digits on screen
+            for on_screen in range(1, 5):
+                texts.append(step_text(step, digit, on_screen))
+        # Deleting leaves 0-3 digits on screen
+        for on_screen in range(4):
+            texts.append(step_text(step, DELETE, on_screen))
+    for line in completion_lines:
+        texts.append(completion_text(line))
+    return texts
+
+
+class SegmentCache:
+    """Directory of single-frame H.264 segments keyed by frame text"""
+
+    def __init__(self, render, directory=SEGMENT_DIR):
+        self.render = render
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def available(self):
+        """Segments are used once the cache directory has been built"""
+        return os.path.isdir(self.directory)
+
+    def path(self, text):
+        """Segment file for a frame; the key covers the encoder settings too"""
+        key = hashlib.sha1('\0'.join(ENCODE_ARGS + [FRAMERATE, text]).encode('utf-8'))
+        return os.path.join(os.path.abspath(self.directory), key.hexdigest() + '.mp4')
+
+    def encode(self, text):
+        """Encode one frame into its segment file"""
+        path = self.path(text)
+        os.makedirs(self.directory, exist_ok=True)
+        # The frame goes to a workspace; the segment is written next to its
+        # final name, so publishing it is a rename on the same filesystem
+        work_dir = tempfile.mkdtemp(prefix='segment_', dir=self.directory)
+        partial = os.path.join(work_dir, 'segment.mp4')
+        try:
+            with open_workspace('segment_') as workspace:
+                workspace.add_frame(self.render(text))
+                cmd = ['ffmpeg', '-y'] + workspace.input_args(FRAMERATE) + ENCODE_ARGS + [partial]
+                subprocess.run(cmd, check=True, capture_output=True, pass_fds=workspace.pass_fds)
+            # Publish atomically so concurrent requests never see half a file
+            os.replace(partial, path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return path
+
+    def ensure(self, text):
+        """Return the segment for a frame, encoding it if it is missing"""
+        path = self.path(text)
+        if os.path.exists(path):
+            with self._lock:
+                self.hits += 1
+            return path
+        with self._lock:
+            self.misses += 1
+        return self.encode(text)
+
+    def concat(self, texts, output):
+        """Stitch the segments for texts into output without re-encoding"""
+        paths = [self.ensure(text) for text in texts]
+        return concat_copy(paths, output)
+
+    def build(self, texts, jobs=None):
+        """Encode every missing segment, jobs ffmpeg processes at a time"""
+        missing = [text for text in texts if not os.path.exists(self.path(text))]
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            for done, _ in enumerate(pool.map(self.encode, missing), 1):
+                if done % 100 == 0 or done == len(missing):
+                    print(f"Encoded {done}/{len(missing)} segments")
+        return len(missing)
+
+    def stats(self):
+        """Hit/miss counters"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--dir', default=SEGMENT_DIR, help='segment cache directory')
+    parser.add_argument('--max-step', type=int, default=BUILD_MAX_STEP,
+                        help='highest step number to pre-encode')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='concurrent ffmpeg processes (default: CPU count)')
+    args = parser.parse_args()
+
+    from frame_atlas import FrameAtlas
+    cache = SegmentCache(FrameAtlas().render, directory=args.dir)
+    texts = frame_texts(args.max_step)
+    encoded = cache.build(texts, jobs=args.jobs)
+    print(f"✅ {len(texts)} segments in {args.dir} ({encoded} newly encoded)")
+
+
+if __name__ == "__main__":
+    main()
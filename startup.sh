@@ -3,5 +3,8 @@
 apt-get update
 apt-get install -y ffmpeg
 
-# Start the application with gunicorn
-gunicorn --bind=0.0.0.0 --timeout 600 application:application
+# Start the application with gunicorn. Generation jobs live in-process and
+# run on their own worker pool (ENCODE_LIMIT at once), so use one worker process with
+# threads for HTTP concurrency; requests no longer wait on ffmpeg. gunicorn.conf.py
+# preloads and warms the app in the master before forking
+gunicorn --bind=0.0.0.0 --workers 1 --threads 16 --timeout 120 application:application
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Exact distributions of the plan walk, as a Markov chain
+
+plan.walk() is a Markov chain over (total_digits_typed, digits_on_screen,
+correct_digits_typed): each loop iteration enters at most one digit and
+deletes at most one, with fair coin flips deciding the optional moves. This
+module propagates the exact probability mass through that chain, for every
+string length and pair of target positions, to get:
+
+* the number of steps (frames, minus the completion frame) a plan has
+* the number of loop iterations (coin-flip rounds) plan.walk() runs
+
+Every digit of the string is entered exactly once and the walk ends with the
+4 password digits on screen, so a plan of length L always has L entries and
+L - 4 deletions: 2L - 4 steps, 16 to 26. Only the iteration count is random
+(with a geometric tail); it costs CPU in the walk but adds no frames.
+
+plan.new_plan(max_steps=N) (PLAN_MAX_STEPS in the app) is the bounded
+sampler: it redraws longer plans, which acceptance(N) says how often happens.
+
+    python step_model.py [samples]   # print the distributions, check them
+"""
+import random
+import sys
+from collections import defaultdict
+
+from plan import DELETE, new_plan
+
+MIN_LENGTH = 10
+MAX_LENGTH = 15
+
+# Stop propagating once less than this much probability is still walking
+TOLERANCE = 1e-12
+
+
+def target_pairs(length):
+    """(first, second) target positions with their probabilities"""
+    pairs = {}
+    firsts = range(0, length - 5)
+    for first in firsts:
+        seconds = range(first + 1, length - 3)
+        for second in seconds:
+            pairs[(first, second)] = 1 / len(firsts) / len(seconds)
+    return pairs
+
+
+def transitions(length, targets, typed, on_screen, correct):
+    """Outcomes of one walk() iteration: (probability, typed, on_screen, correct, steps)"""
+    # Entering: forced off, forced on/off at a target, or a coin flip
+    if on_screen == 3 and typed < length - 1:
+        enters = [(1.0, False)]
+    elif typed == targets[correct]:
+        enters = [(1.0, correct == on_screen)]
+    else:
+        enters = [(0.5, True), (0.5, False)]
+
+    outcomes = []
+    for p_enter, enter in enters:
+        t, s, c, steps = typed, on_screen, correct, 0
+        if enter:
+            if typed == targets[correct]:
+                c += 1
+            t += 1
+            s += 1
+            steps += 1
+        # Deleting: a coin flip whenever a non-target digit is on screen
+        if c < s:
+            outcomes.append((p_enter * 0.5, t, s - 1, c, steps + 1))
+            outcomes.append((p_enter * 0.5, t, s, c, steps))
+        else:
+            outcomes.append((p_enter, t, s, c, steps))
+    return outcomes
+
+
+def walk_distribution(length, targets, tolerance=TOLERANCE):
+    """Exact (steps, iterations) distributions of walk() for fixed targets
+
+    Returns two dicts of value -> probability. The iteration distribution is
+    cut off once less than `tolerance` of the mass is still walking.
+    """
+    targets = list(targets) + [length - 2, length - 1]
+    live = {(0, 0, 0, 0): 1.0}  # (typed, on_screen, correct, steps) -> mass
+    steps_dist = defaultdict(float)
+    iterations_dist = defaultdict(float)
+    iteration = 0
+    while live and sum(live.values()) >= tolerance:
+        iteration += 1
+        nxt = defaultdict(float)
+        for (typed, on_screen, correct, steps), mass in live.items():
+            for p, t, s, c, added in transitions(length, targets, typed, on_screen, correct):
+                if c == 4:
+                    steps_dist[steps + added] += mass * p
+                    iterations_dist[iteration] += mass * p
+                else:
+                    nxt[(t, s, c, steps + added)] += mass * p
+        live = nxt
+    return dict(steps_dist), dict(iterations_dist)
+
+
+def length_distribution(length, tolerance=TOLERANCE):
+    """(steps, iterations) distributions for strings of this length"""
+    steps_dist = defaultdict(float)
+    iterations_dist = defaultdict(float)
+    for pair, weight in target_pairs(length).items():
+        steps, iterations = walk_distribution(length, pair, tolerance)
+        for value, p in steps.items():
+            steps_dist[value] += weight * p
+        for value, p in iterations.items():
+            iterations_dist[value] += weight * p
+    return dict(steps_dist), dict(iterations_dist)
+
+
+def plan_distribution(tolerance=TOLERANCE):
+    """(steps, iterations) distributions of plan.new_plan(), lengths uniform"""
+    lengths = range(MIN_LENGTH, MAX_LENGTH + 1)
+    steps_dist = defaultdict(float)
+    iterations_dist = defaultdict(float)
+    for length in lengths:
+        steps, iterations = length_distribution(length, tolerance)
+        for value, p in steps.items():
+            steps_dist[value] += p / len(lengths)
+        for value, p in iterations.items():
+            iterations_dist[value] += p / len(lengths)
+    return dict(steps_dist), dict(iterations_dist)
+
+
+def quantile(dist, q):
+    """Smallest value whose cumulative probability reaches q"""
+    total = 0.0
+    for value in sorted(dist):
+        total += dist[value]
+        if total >= q - 1e-12:
+            return value
+    return max(dist)
+
+
+def acceptance(max_steps):
+    """Probability that a plan has at most max_steps steps"""
+    steps, _ = plan_distribution()
+    return sum(p for value, p in steps.items() if value <= max_steps)
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"{'length':>6} {'steps':>12} {'iterations p50':>15} {'p99':>5} {'p99.9':>6}")
+    for length in range(MIN_LENGTH, MAX_LENGTH + 1):
+        steps, iterations = length_distribution(length)
+        spread = ', '.join(f'{value}: {p:.3f}' for value, p in sorted(steps.items()))
+        print(f"{length:>6} {spread:>12} {quantile(iterations, 0.5):>15} "
+              f"{quantile(iterations, 0.99):>5} {quantile(iterations, 0.999):>6}")
+
+    steps, iterations = plan_distribution()
+    print(f"All plans: steps {min(steps)}-{max(steps)} (p99 {quantile(steps, 0.99)}), "
+          f"iterations p50 {quantile(iterations, 0.5)}, p99 {quantile(iterations, 0.99)}, "
+          f"p99.9 {quantile(iterations, 0.999)}")
+
+    # Check the step counts against plan.new_plan()
+    rng = random.Random(0)
+    observed = defaultdict(int)
+    deletions_ok = True
+    for _ in range(samples):
+        plan = new_plan(rng)
+        observed[len(plan)] += 1
+        deletions_ok &= plan.ops.count(DELETE) == len(plan.random_string) - 4
+    worst = max(abs(observed[value] / samples - steps.get(value, 0.0))
+                for value in set(observed) | set(steps))
+    print(f"Simulated {samples} plans: largest step-count probability error {worst:.4f}; "
+          f"deletions {'always' if deletions_ok else 'NOT always'} length - 4")
+    sys.exit(0 if deletions_ok and worst < 0.02 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Encode step frames into an MP4 with ffmpeg
+
+Frames are streamed into ffmpeg's stdin as raw 8-bit grayscale while they
+are rendered, so rendering overlaps encoding and nothing touches the disk
+except the finished video. If the pipe fails the frames are written out as
+PNGs to a workspace (in memory where possible, see workspace.py) and
+encoded from there instead.
+"""
+import os
+import subprocess
+import threading
+import time
+
+from metrics import ENCODER_FAILURES, Timings
+from plan import FRAME_SECONDS
+from workspace import open_workspace
+
+# One frame every FRAME_SECONDS
+FRAMERATE = f'1/{FRAME_SECONDS}'
+
+# Output settings shared by every encode path (and by pre-encoded segments,
+# which can only be stream-copied together if these match)
+VIDEO_CODEC = 'libx264'
+PIX_FMT = 'yuv420p'
+ENCODE_ARGS = ['-c:v', VIDEO_CODEC, '-pix_fmt', PIX_FMT]
+
+# Set FRAME_PIPE=0 to always go through PNG files on disk
+USE_PIPE = os.environ.get('FRAME_PIPE', '1') != '0'
+
+# Streamed output: fragmented MP4 that can be played while it is written.
+# empty_moov puts the header up front; a fragment per frame (and no x264
+# lookahead) means each step is sent as soon as it is encoded, instead of
+# once per keyframe interval, which would be the whole video here.
+STREAM_ARGS = ['-tune', 'zerolatency',
+               '-movflags', 'frag_keyframe+frag_every_frame+empty_moov+default_base_moof']
+
+# Largest read from ffmpeg's stdout per streamed chunk
+STREAM_CHUNK = 64 * 1024
+
+
+def pipe_command(atlas, output):
+    """ffmpeg command encoding gray8 rawvideo frames from stdin into output"""
+    return [
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        '-s', f'{atlas.width}x{atlas.height}',
+        '-framerate', FRAMERATE,
+        '-i', 'pipe:0',
+    ] + ENCODE_ARGS + ['-f', 'mp4', output]
+
+
+def encode_pipe(texts, output, atlas, progress=None, timings=None):
+    """Render frames straight into ffmpeg's stdin as rawvideo gray8
+
+    Rendering and encoding overlap here, so time spent producing frames
+    counts as render and time blocked on ffmpeg (writes, final flush) as
+    encode.
+    """
+    timings = timings if timings is not None else Timings()
+    render = encode = 0.0
+    clock = time.perf_counter
+    cmd = pipe_command(atlas, output)
+    # stderr is only read once stdin is closed; -v error keeps it far below
+    # the pipe buffer so ffmpeg can't block on it mid-stream
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        for text in texts:
+            start = clock()
+            frame = atlas.render_gray(text).tobytes()
+            rendered = clock()
+            proc.stdin.write(frame)
+            render += rendered - start
+            encode += clock() - rendered
+            if progress:
+                progress()
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its status and stderr explain why
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        timings.add('render', render)
+        timings.add('encode', encode)
+    with timings.stage('encode'):
+        _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+
+
+def encode_png(texts, output, atlas, progress=None, timings=None):
+    """Write frames as PNGs to a workspace and encode them from there"""
+    timings = timings if timings is not None else Timings()
+    workspace = open_workspace('password_frames_')
+    try:
+        for text in texts:
+            with timings.stage('render'):
+                frame = atlas.render(text)
+            with timings.stage('save'):
+                workspace.add_frame(frame)
+            if progress:
+                progress()
+        cmd = ['ffmpeg', '-y'] + workspace.input_args(FRAMERATE) + ENCODE_ARGS + ['-f', 'mp4', output]
+        with timings.stage('encode'):
+            subprocess.run(cmd, check=True, capture_output=True, pass_fds=workspace.pass_fds)
+    finally:
+        with timings.stage('cleanup'):
+            workspace.close()
+
+
+def encode_video(texts, output, atlas, progress=None, timings=None):
+    """Encode one frame per text into output, replacing it atomically
+
+    progress, if given, is called once for every frame handed to ffmpeg;
+    stage durations are added to timings (a metrics.Timings) if given.
+    """
+    timings = timings if timings is not None else Timings()
+    partial = output + '.part'
+    try:
+        if USE_PIPE:
+            try:
+                encode_pipe(texts, partial, atlas, progress, timings)
+            except (OSError, subprocess.CalledProcessError) as e:
+                if isinstance(e, FileNotFoundError):
+                    raise  # no ffmpeg at all; the disk path can't help
+                ENCODER_FAILURES.inc('fallback')
+                encode_png(texts, partial, atlas, progress, timings)
+        else:
+            encode_png(texts, partial, atlas, progress, timings)
+        with timings.stage('move'):
+            os.replace(partial, output)
+    finally:
+        with timings.stage('cleanup'):
+            if os.path.exists(partial):
+                os.remove(partial)
+    return output
+
+
+def concat_copy(paths, output):
+    """Join MP4s encoded with identical settings into output via stream copy"""
+    # The concat list goes over stdin, so no list file is written
+    listing = ''.join(f"file 'file:{os.path.abspath(path)}'\n" for path in paths)
+    partial = output + '.part'
+    cmd = [
+        'ffmpeg', '-y',
+        '-protocol_whitelist', 'file,pipe',
+        '-f', 'concat', '-safe', '0',
+        '-i', 'pipe:0',
+        '-c', 'copy',
+        '-f', 'mp4', partial
+    ]
+    try:
+        subprocess.run(cmd, input=listing.encode('utf-8'), check=True, capture_output=True)
+        os.replace(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return output
+
+
+def stream_fragmented(texts, atlas, timings=None):
+    """Yield a fragmented MP4 of the frames as ffmpeg produces it
+
+    Frames are fed to ffmpeg from a helper thread while its stdout is read
+    here, so the first chunk (header plus first fragment) is ready after
+    roughly one frame instead of after the whole encode. Closing the
+    generator early (client went away) kills ffmpeg.
+    """
+    timings = timings if timings is not None else Timings()
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        '-s', f'{atlas.width}x{atlas.height}',
+        '-framerate', FRAMERATE,
+        '-i', 'pipe:0',
+    ] + ENCODE_ARGS + STREAM_ARGS + ['-f', 'mp4', 'pipe:1']
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        try:
+            for text in texts:
+                with timings.stage('render'):
+                    frame = atlas.render_gray(text).tobytes()
+                proc.stdin.write(frame)
+                proc.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            pass  # ffmpeg exited or was killed; the reader reports why
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, name='stream-feed', daemon=True)
+    feeder.start()
+    finished = False
+    try:
+        while True:
+            chunk = proc.stdout.read1(STREAM_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            proc.kill()
+        feeder.join()
+        # -v error keeps stderr tiny, so it can wait until ffmpeg is done
+        stderr = proc.stderr.read()
+        proc.stdout.close()
+        proc.stderr.close()
+        proc.wait()
+    if proc.returncode != 0:
+        ENCODER_FAILURES.inc('error')
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
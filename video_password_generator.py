@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
-import random
+"""Screentime password generator demo video
+
+    python video_password_generator.py    # password_generator_demo.mp4
+    python video_password_generator.py --count 100 --jobs 4 --out-dir videos_out
+"""
+import argparse
+import hashlib
+import json
 import time
 import subprocess
 import sys
-from PIL import Image, ImageDraw, ImageFont
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
 import os
+from font_cache import registry as fonts
+from render_pool import RenderPool
+from workspace import open_workspace
+from entropy import pool as entropy
+from plan import Plan, generate_random_string, pick_target_indices, walk
+
+# Frame layout of create_text_image below, for rendering in worker processes
+CLI_LAYOUT = {'font_size': 34, 'top': 50, 'line_gap': 10, 'skip_blank': False}
 
 def copy_to_clipboard(text):
     """Copy text to clipboard using different methods based on OS"""
@@ -29,103 +46,32 @@ def copy_to_clipboard(text):
     except Exception as e:
         return False
 
-def generate_random_string(length):
-    """Generate a random string of digits"""
-    return ''.join([str(random.randint(0, 9)) for _ in range(length)])
-
 def create_text_image(text, width=800, height=600, font_size=34):
     """Create an image with text"""
     # Create a black background
     img = Image.new('RGB', (width, height), color='black')
-    draw = ImageDraw.Draw(img)
     
-    # Try to use a default font, fallback to basic if not available
-    try:
-        font = ImageFont.truetype("/System/Library/Fonts/Monaco.ttf", font_size)
-    except:
-        try:
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf", font_size)
-        except:
-            font = ImageFont.load_default()
-    
-    # Split text into lines and draw them
+    # Split text into lines and draw them using the cached font and bitmaps
     lines = text.split('\n')
     y_offset = 50
     
     for line in lines:
         # Center the text horizontally
-        bbox = draw.textbbox((0, 0), line, font=font)
-        text_width = bbox[2] - bbox[0]
+        text_width = fonts.text_width(line, font_size)
         x = (width - text_width) // 2
         
-        draw.text((x, y_offset), line, fill='white', font=font)
+        fonts.draw_text(img, (x, y_offset), line, font_size, fill='white')
         y_offset += font_size + 10
     
     return img
 
 def output_password(target_indices, random_string, string_length, outputs):
     """Modified output_password that saves to outputs list instead of printing"""
-    # Initialize state variables
-    digits_on_screen = 0
-    total_digits_typed = 0
-    correct_digits_typed = 0
-    
-    step = 1
-    
-    while correct_digits_typed < 4:
-        
-        # Check if the next digit to type is a target digit
-        next_target_index = target_indices[correct_digits_typed]
-        
-        # Prevent entering 4th digit unless we're at the last position
-        if digits_on_screen == 3 and total_digits_typed < string_length - 1:
-            digits_to_type = 0  # Don't enter 4th digit unless at the end
-        # If we're at a target digit position
-        elif total_digits_typed == target_indices[correct_digits_typed]:
-            # Check if this target digit will be placed in the correct position (rightmost)
-            if correct_digits_typed == digits_on_screen:
-                # Target digit will be placed in the right spot
-                digits_to_type = 1
-                correct_digits_typed += 1
-            else:
-                # Target digit would be placed in wrong spot, skip for now
-                digits_to_type = 0
-        else:
-            # Not at a target digit, randomly decide to insert or not
-            if random.random() < 0.5:
-                digits_to_type = 1
-            else:
-                digits_to_type = 0
-
-        # Get the digit to type
-        digit_to_enter = random_string[total_digits_typed]
-        
-        if digits_to_type > 0:
-            # Combine all step outputs into one frame
-            step_output = f"--- Step {step} ---\n"
-            step_output += f"Enter this digit: {digit_to_enter}\n"
-            #step_output += "Press Enter after you've typed this digit into your iPhone...\n"
-            digits_on_screen += digits_to_type
-            total_digits_typed += digits_to_type
-            step_output += f"Digits on screen: {digits_on_screen}"
-            outputs.append(step_output)
-            step += 1
-
-        # Deletion logic: only delete if we have non-target digits on screen
-        if correct_digits_typed < digits_on_screen:
-            if random.random() < 0.5:
-                # Combine all deletion step outputs into one frame
-                step_output = f"--- Step {step} ---\n"
-                step_output += "Delete 1 digit from the right\n"
-                #step_output += "Press Enter after you've deleted this digit...\n"
-                digits_on_screen -= 1
-                step_output += f"Digits on screen: {digits_on_screen}"
-                outputs.append(step_output)
-                step += 1
-    
-    outputs.append("=" * 40 + "\n🎉 PASSWORD COMPLETE!")
+    ops, on_screen = walk(random_string[:string_length], target_indices)
+    outputs.extend(Plan(random_string, target_indices, ops, on_screen).iter_steps())
 
-def main():
+def password_frames():
+    """Generate a password; returns it with the text of every frame of its video"""
     outputs = []
     
     # Initial setup - combine into one frame
@@ -135,26 +81,11 @@ def main():
     outputs.append(initial_output)
     
     # Generate a long random string (10-15 digits)
-    string_length = random.randint(10, 15)
+    string_length = entropy.randint(10, 15)
     random_string = generate_random_string(string_length)
     
     # Pick 4 target digits from the string
-    target_indices = []
-    
-    # 1st digit: random position in first 2/3
-    first_max = string_length - 6
-    target_indices.append(random.randint(0, first_max))
-    
-    # 2nd digit: after 1st digit
-    second_min = target_indices[0] + 1
-    second_max = string_length - 4
-    target_indices.append(random.randint(second_min, second_max))
-    
-    # 3rd digit: 2nd to last position
-    target_indices.append(string_length - 2)
-    
-    # 4th digit: last position
-    target_indices.append(string_length - 1)
+    target_indices = pick_target_indices(string_length)
     
     # Create target password
     target_password = ''.join([random_string[i] for i in target_indices])
@@ -176,38 +107,119 @@ def main():
     final_output += "=" * 40
     outputs.append(final_output)
     
+    return target_password, outputs
+
+def encode_frames(workspace, output, quiet=False):
+    """Encode a workspace's frames into an MP4 at output"""
+    # Create video with 10 seconds per frame
+    cmd = ['ffmpeg', '-y']  # -y to overwrite output file
+    if quiet:
+        cmd += ['-loglevel', 'error']
+    cmd += workspace.input_args('1/10')  # 1 frame per 10 seconds
+    cmd += [
+        '-c:v', 'libx264',  # Video codec
+        '-pix_fmt', 'yuv420p',  # Pixel format for compatibility
+        '-f', 'mp4',  # output may be a .part file
+        output  # Output file
+    ]
+    subprocess.run(cmd, check=True, pass_fds=workspace.pass_fds)
+
+def make_video(out_dir):
+    """One batch video, made in a private workspace and moved into out_dir
+    
+    Returns its manifest entry. Runs in a worker process.
+    """
+    start = time.perf_counter()
+    password, outputs = password_frames()
+    video = os.path.join(out_dir, f"password_{uuid.uuid4()}.mp4")
+    try:
+        with open_workspace('password_video_') as workspace:
+            for output in outputs:
+                workspace.add_frame(create_text_image(output))
+            encode_frames(workspace, video + '.part', quiet=True)
+        os.replace(video + '.part', video)
+    finally:
+        if os.path.exists(video + '.part'):
+            os.remove(video + '.part')
+    return {
+        'video': video,
+        # For matching a video to a password, not for hiding it: a 4-digit
+        # password is found from its hash in 10,000 tries
+        'password_sha256': hashlib.sha256(password.encode()).hexdigest(),
+        'frames': len(outputs),
+        'seconds': round(time.perf_counter() - start, 3)
+    }
+
+def run_batch(count, jobs, out_dir):
+    """Make count videos, jobs at a time, appending to out_dir/manifest.jsonl"""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, 'manifest.jsonl')
+    print(f"Making {count} videos with {jobs} jobs in {out_dir}/")
+    
+    start = time.perf_counter()
+    made = frames = failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor, open(manifest_path, 'a') as manifest:
+        futures = [executor.submit(make_video, out_dir) for _ in range(count)]
+        for future in as_completed(futures):
+            try:
+                entry = future.result()
+            except (subprocess.CalledProcessError, OSError) as e:
+                failed += 1
+                print(f"❌ Error creating video: {e}")
+                continue
+            manifest.write(json.dumps(entry) + '\n')
+            manifest.flush()
+            made += 1
+            frames += entry['frames']
+            print(f"Created video {made}/{count}: {entry['video']} ({entry['seconds']:.1f}s)")
+    elapsed = time.perf_counter() - start
+    
+    print(f"✅ {made} videos ({frames} frames) in {elapsed:.1f}s: "
+          f"{made / elapsed * 60:.1f} videos/min, {frames / elapsed:.1f} frames/s")
+    print(f"Manifest: {manifest_path}")
+    if failed:
+        print(f"❌ {failed} videos failed")
+    return failed == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Screentime password generator video")
+    parser.add_argument('--count', type=int,
+                        help="make this many videos in parallel instead of the demo video")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help="videos made at once in batch mode (default: one per core)")
+    parser.add_argument('--out-dir', default='password_videos',
+                        help="batch mode output directory, with manifest.jsonl")
+    args = parser.parse_args()
+    if args.count is not None:
+        sys.exit(0 if run_batch(args.count, max(1, args.jobs), args.out_dir) else 1)
+    
+    target_password, outputs = password_frames()
+    
+    # Frames go to a private workspace (in memory where possible), so
+    # concurrent runs don't collide
+    workspace = open_workspace('password_video_')
+    
     # Create images for each output
     print("Creating images...")
-    image_files = []
-    
-    for i, output in enumerate(outputs):
-        img = create_text_image(output)
-        filename = f"frame_{i:03d}.png"
-        img.save(filename)
-        image_files.append(filename)
-        print(f"Created frame {i+1}/{len(outputs)}: {output[:50]}...")
-    
-    # Create video using ffmpeg
-    print("Creating video...")
+    pool = RenderPool(layout=CLI_LAYOUT)
     try:
-        # Create video with 10 seconds per frame
-        cmd = [
-            'ffmpeg', '-y',  # -y to overwrite output file
-            '-framerate', '1/10',  # 1 frame per 10 seconds
-            '-i', 'frame_%03d.png',  # Input pattern
-            '-c:v', 'libx264',  # Video codec
-            '-pix_fmt', 'yuv420p',  # Pixel format for compatibility
-            'password_generator_demo.mp4'  # Output file
-        ]
+        if pool.enabled:
+            # Spread rendering over RENDER_PROCESSES worker processes
+            for data in pool.render_pngs(outputs):
+                workspace.add_png(data)
+            pool.shutdown()
+            print(f"Created {len(outputs)} frames using {pool.processes} processes")
+        else:
+            for i, output in enumerate(outputs):
+                img = create_text_image(output)
+                workspace.add_frame(img)
+                print(f"Created frame {i+1}/{len(outputs)}: {output[:50]}...")
         
-        subprocess.run(cmd, check=True)
+        # Create video using ffmpeg
+        print("Creating video...")
+        encode_frames(workspace, 'password_generator_demo.mp4')
         print("✅ Video created: password_generator_demo.mp4")
         
-        # Clean up image files
-        for filename in image_files:
-            os.remove(filename)
-        print("✅ Cleaned up temporary image files")
-        
     except subprocess.CalledProcessError as e:
         print(f"❌ Error creating video: {e}")
         print("Make sure ffmpeg is installed: brew install ffmpeg")
@@ -216,6 +228,10 @@ def main():
         print("  macOS: brew install ffmpeg")
         print("  Ubuntu: sudo apt install ffmpeg")
         print("  Windows: Download from https://ffmpeg.org/")
+    finally:
+        # Clean up image files
+        workspace.close()
+        print("✅ Cleaned up temporary image files")
 
 if __name__ == "__main__":
     main()
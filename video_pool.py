@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Pool of pre-generated passwords with their videos already encoded
+
+A producer thread keeps between the low- and high-water marks of finished
+entries ready: once a take() leaves the pool at or below the low mark it
+refills up to the high mark, one entry at a time. take() pops under a lock,
+so an entry is handed out at most once; when the pool is empty the caller
+generates inline as before (a miss).
+
+The pool doesn't know what an entry is; produce() makes one and accept(),
+if given, can reject stale entries at take() time.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+# Entries kept ready; 0 disables the pool
+POOL_HIGH = int(os.environ.get('VIDEO_POOL_HIGH', 0))
+
+# Refill once the pool is down to this many entries
+POOL_LOW = int(os.environ.get('VIDEO_POOL_LOW', max(0, POOL_HIGH // 4)))
+
+
+class VideoPool:
+    """Pre-generated entries, refilled in the background between two marks"""
+
+    def __init__(self, produce, low=POOL_LOW, high=POOL_HIGH, accept=None):
+        self.produce = produce
+        self.low = min(low, high)
+        self.high = high
+        self.accept = accept
+        self._entries = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._producer = None
+        self._counts = {'hits': 0, 'misses': 0, 'stale': 0, 'produced': 0, 'failed': 0}
+        self._busy = 0.0  # seconds spent producing
+
+    @property
+    def enabled(self):
+        return self.high > 0
+
+    def start(self):
+        """Start the producer (once) and fill the pool up to the high mark"""
+        if not self.enabled or self._producer is not None:
+            return
+        with self._lock:
+            if self._producer is None:
+                self._producer = threading.Thread(target=self._produce_loop,
+                                                  name='video-pool', daemon=True)
+                self._producer.start()
+        self._wake.set()
+
+    def take(self):
+        """Pop a ready entry, or None if there is none (a miss)"""
+        if not self.enabled:
+            return None
+        self.start()
+        while True:
+            with self._lock:
+                if not self._entries:
+                    self._counts['misses'] += 1
+                    entry = None
+                else:
+                    entry = self._entries.popleft()
+                if len(self._entries) <= self.low:
+                    self._wake.set()
+            if entry is None or self.accept is None or self.accept(entry):
+                break
+            with self._lock:
+                self._counts['stale'] += 1
+        if entry is not None:
+            with self._lock:
+                self._counts['hits'] += 1
+        return entry
+
+    def depth(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        """Depth, hits/misses, production counts and refill rate"""
+        with self._lock:
+            stats = dict(self._counts)
+            stats['depth'] = len(self._entries)
+            stats['low'] = self.low
+            stats['high'] = self.high
+            # Entries produced per second of producer work
+            stats['refill_rate'] = stats['produced'] / self._busy if self._busy else 0.0
+        return stats
+
+    def _produce_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while self.depth() < self.high:
+                start = time.perf_counter()
+                try:
+                    entry = self.produce()
+                except Exception:
+                    with self._lock:
+                        self._counts['failed'] += 1
+                        self._busy += time.perf_counter() - start
+                    time.sleep(1)  # don't spin on a persistent failure
+                    continue
+                with self._lock:
+                    self._entries.append(entry)
+                    self._counts['produced'] += 1
+                    self._busy += time.perf_counter() - start
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Conditional, range-aware responses for stored videos
+
+A stored video never changes once written (every video gets a new id), so
+it gets a strong ETag from its id, size and mtime, and browsers may cache
+it for a year as immutable. Requests are answered as RFC 9110 asks:
+
+* If-None-Match (or, without one, If-Modified-Since) still matching: 304
+* a single byte range, honoured only while If-Range (if sent) still
+  matches: 206 with Content-Range; a range starting past the end: 416
+* several ranges, other units, or a Range header that doesn't parse: the
+  whole file
+
+The bytes never pass through Python: the file is handed to the WSGI
+server's wsgi.file_wrapper positioned at the range start, and gunicorn
+sends Content-Length bytes from there with os.sendfile(). Behind a proxy,
+VIDEO_SENDFILE=accel (nginx X-Accel-Redirect) or =xsendfile (Apache or
+lighttpd X-Sendfile) lets the proxy send the file, ranges included.
+"""
+import os
+
+from werkzeug.http import http_date, parse_date, parse_etags, parse_range_header, quote_etag
+from werkzeug.wrappers import Response
+
+# Who sends the file: sendfile (the WSGI server), accel or xsendfile (the proxy)
+VIDEO_SENDFILE = os.environ.get('VIDEO_SENDFILE', 'sendfile')
+
+# Internal nginx location aliased to the video directory, for accel
+VIDEO_ACCEL_PREFIX = os.environ.get('VIDEO_ACCEL_PREFIX', '/_videos/')
+
+# Videos are never rewritten, so the browser may keep them for good; private
+# because each one shows somebody's passcode, which shared caches shouldn't hold
+CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+# Read size when the server has no wsgi.file_wrapper
+CHUNK = 64 * 1024
+
+
+def validators(video_id, stat):
+    """(ETag value, unquoted; Last-Modified, whole seconds) of a video file"""
+    return f'{video_id}-{stat.st_size:x}-{stat.st_mtime_ns:x}', int(stat.st_mtime)
+
+
+def _if_range_matches(value, etag, modified):
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith(('"', 'W/')):
+        return value == quote_etag(etag)  # strong comparison: weak tags never match
+    date = parse_date(value)
+    return date is not None and int(date.timestamp()) == modified
+
+
+def evaluate(etag, modified, size, headers, method='GET', ranges=True):
+    """(status, start, length) of the answer to a request with these headers
+
+    headers needs only .get() with lower-case names.
+    """
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        if parse_etags(if_none_match).contains_weak(etag):
+            return 304, 0, 0
+    else:
+        since = parse_date(headers.get('if-modified-since'))
+        if since is not None and modified <= since.timestamp():
+            return 304, 0, 0
+
+    range_header = headers.get('range')
+    if ranges and range_header and method == 'GET' and \
+            _if_range_matches(headers.get('if-range'), etag, modified):
+        requested = parse_range_header(range_header)
+        if requested is not None and requested.units == 'bytes' and len(requested.ranges) == 1:
+            span = requested.range_for_length(size)
+            if span is None:
+                return 416, 0, 0
+            return 206, span[0], span[1] - span[0]
+    return 200, 0, size
+
+
+def response_headers(etag, modified, status, start, length, size, ranges=True):
+    """Validator, caching and range headers for an answer from evaluate()"""
+    headers = [
+        ('ETag', quote_etag(etag)),
+        ('Last-Modified', http_date(modified)),
+        ('Cache-Control', CACHE_CONTROL),
+    ]
+    if ranges:
+        headers.append(('Accept-Ranges', 'bytes'))
+    if status == 206:
+        headers.append(('Content-Range', f'bytes {start}-{start + length - 1}/{size}'))
+    elif status == 416:
+        headers.append(('Content-Range', f'bytes */{size}'))
+    return headers
+
+
+def read_range(file, length):
+    """Iterate over length bytes from file's position, then close it"""
+    try:
+        while length > 0:
+            data = file.read(min(CHUNK, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def video_response(environ, headers, video_id, path, mimetype):
+    """WSGI response for a stored video; FileNotFoundError if it is gone"""
+    proxied = VIDEO_SENDFILE in ('accel', 'xsendfile')
+    file = open(path, 'rb')
+    try:
+        stat = os.fstat(file.fileno())
+        etag, modified = validators(video_id, stat)
+        status, start, length = evaluate(etag, modified, stat.st_size, headers,
+                                         environ.get('REQUEST_METHOD', 'GET'), ranges=not proxied)
+        extra = response_headers(etag, modified, status, start, length, stat.st_size,
+                                 ranges=not proxied)
+        if status not in (200, 206):
+            file.close()
+            return Response(status=status, headers=extra)
+        if proxied:
+            # The proxy answers ranges and sends the bytes itself
+            file.close()
+            if VIDEO_SENDFILE == 'accel':
+                root = os.path.dirname(os.path.dirname(path))
+                extra.append(('X-Accel-Redirect',
+                              VIDEO_ACCEL_PREFIX + os.path.relpath(path, root).replace(os.sep, '/')))
+            else:
+                extra.append(('X-Sendfile', os.path.abspath(path)))
+            return Response(status=status, headers=extra, mimetype=mimetype)
+        file.seek(start)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        # gunicorn's wrapper sends Content-Length bytes from the current
+        # position with sendfile(); others get a bounded read loop
+        body = file_wrapper(file, CHUNK) if file_wrapper else read_range(file, length)
+    except BaseException:
+        file.close()
+        raise
+    response = Response(body, status=status, headers=extra, mimetype=mimetype,
+                        direct_passthrough=True)
+    response.content_length = length
+    return response
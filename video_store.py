@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Byte- and age-bounded store for generated videos
+
+Videos live at <root>/<first 2 chars of id>/<id><ext>, so no directory grows
+past a few hundred entries. An in-memory index (id -> size, creation and
+last access time, in LRU order) answers every lookup and drives eviction:
+
+* past the byte budget, the least recently used videos go first
+* videos older than the TTL are removed by a background janitor thread
+
+The directory is only scanned once, at start-up, to pick up videos left by
+a previous process and remove encodes it abandoned.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+VIDEO_DIR = os.environ.get('VIDEO_STORE_DIR', 'videos')
+
+# Total size of stored videos (default 1 GiB)
+MAX_BYTES = int(os.environ.get('VIDEO_STORE_BYTES', 1 << 30))
+
+# Seconds a video is kept after it is created; matches the job TTL so a
+# finished job's video_url stays valid while the job can still be polled
+VIDEO_TTL = int(os.environ.get('VIDEO_TTL', 3600))
+
+# Seconds since a .part file was last written before the start-up scan
+# treats its encode as dead and removes it. Other processes may share the
+# directory (workers, restarts, asgi.py next to gunicorn), so a fresh one
+# can be an encode still running elsewhere.
+PART_MAX_AGE = int(os.environ.get('VIDEO_PART_MAX_AGE', 3600))
+
+# Seconds between janitor sweeps
+JANITOR_INTERVAL = int(os.environ.get('VIDEO_JANITOR_INTERVAL', 60))
+
+SUFFIX = '.mp4'
+
+# File types the start-up scan picks up (MP4 and the animated image formats)
+EXTENSIONS = ('.mp4', '.webp', '.png', '.gif')
+
+
+class Entry:
+    __slots__ = ('size', 'created', 'accessed', 'extension')
+
+    def __init__(self, size, created, accessed, extension=SUFFIX):
+        self.size = size
+        self.created = created
+        self.accessed = accessed
+        self.extension = extension
+
+
+class VideoStore:
+    """Sharded video directory with LRU and TTL eviction"""
+
+    def __init__(self, root=VIDEO_DIR, max_bytes=MAX_BYTES, ttl=VIDEO_TTL,
+                 janitor_interval=JANITOR_INTERVAL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.janitor_interval = janitor_interval
+        self._entries = OrderedDict()  # least recently used first
+        self._bytes = 0
+        self._evictions = {'lru': 0, 'ttl': 0}
+        self._evicted_bytes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._janitor = None
+        self._load()
+
+    def path(self, video_id, extension=SUFFIX):
+        """Where the video with this id is (or will be) stored"""
+        return os.path.join(self.root, video_id[:2], video_id + extension)
+
+    def reserve(self, video_id, extension=SUFFIX):
+        """Path to write a new video to; call add() once it is complete"""
+        path = self.path(video_id, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def add(self, video_id, extension=SUFFIX):
+        """Index a finished video and evict to stay within the byte budget
+
+        Returns the video's size in bytes.
+        """
+        size = os.path.getsize(self.path(video_id, extension))
+        now = time.time()
+        victims = []
+        with self._lock:
+            old = self._entries.pop(video_id, None)
+            if old is not None:
+                self._bytes -= old.size
+                if old.extension != extension:
+                    victims.append((video_id, old))
+            self._entries[video_id] = Entry(size, now, now, extension)
+            self._bytes += size
+            # Never evict the video just added, even if it alone is too big
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                victims.append(self._pop_oldest('lru'))
+        self._unlink(victims)
+        self.start_janitor()
+        return size
+
+    def get(self, video_id):
+        """Path of a stored, unexpired video (marking it used), or None"""
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None:
+                return None
+            now = time.time()
+            if now - entry.created > self.ttl:
+                return None  # the janitor will remove it
+            entry.accessed = now
+            self._entries.move_to_end(video_id)
+        return self.path(video_id, entry.extension)
+
+    def remove(self, video_id):
+        """Delete a video; returns whether it was stored"""
+        with self._lock:
+            entry = self._entries.pop(video_id, None)
+            if entry is None:
+                return False
+            self._bytes -= entry.size
+        self._unlink([(video_id, entry)])
+        return True
+
+    def evict_expired(self):
+        """Remove every video older than the TTL; returns how many"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [(video_id, entry) for video_id, entry in self._entries.items()
+                       if entry.created < cutoff]
+            for video_id, entry in expired:
+                del self._entries[video_id]
+                self._bytes -= entry.size
+                self._evictions['ttl'] += 1
+                self._evicted_bytes += entry.size
+        self._unlink(expired)
+        return len(expired)
+
+    def start_janitor(self):
+        """Start the background TTL sweep, once"""
+        if self._janitor is not None:
+            return
+        with self._lock:
+            if self._janitor is None:
+                self._janitor = threading.Thread(target=self._janitor_loop,
+                                                 name='video-janitor', daemon=True)
+                self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+        if self._janitor is not None:
+            self._janitor.join()
+            self._janitor = None
+        self._stop.clear()
+
+    def stats(self):
+        """Size of the store and what has been evicted from it"""
+        with self._lock:
+            return {
+                'videos': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': dict(self._evictions),
+                'evicted_bytes': self._evicted_bytes,
+            }
+
+    def _pop_oldest(self, reason):
+        """Drop the least recently used entry; caller holds the lock"""
+        video_id, entry = self._entries.popitem(last=False)
+        self._bytes -= entry.size
+        self._evictions[reason] += 1
+        self._evicted_bytes += entry.size
+        return video_id, entry
+
+    def _unlink(self, entries):
+        for video_id, entry in entries:
+            try:
+                os.remove(self.path(video_id, entry.extension))
+            except OSError:
+                pass  # already gone, or will be found by the next start-up scan
+
+    def _janitor_loop(self):
+        while not self._stop.wait(self.janitor_interval):
+            try:
+                self.evict_expired()
+            except Exception:
+                pass  # never let one bad sweep stop the janitor
+
+    def _remove_abandoned(self, item):
+        """Remove a .part file nobody has written to for PART_MAX_AGE"""
+        try:
+            if time.time() - item.stat().st_mtime > PART_MAX_AGE:
+                os.remove(item.path)  # encode cut short by a restart
+        except FileNotFoundError:
+            pass  # finished or cleaned up by its own process meanwhile
+
+    def _load(self):
+        """Index videos already on disk, oldest access first"""
+        if not os.path.isdir(self.root):
+            return
+        found = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for item in os.scandir(shard.path):
+                video_id, extension = os.path.splitext(item.name)
+                if extension == '.part':
+                    self._remove_abandoned(item)
+                elif extension in EXTENSIONS and item.is_file():
+                    st = item.stat()
+                    found.append((st.st_atime, video_id, extension, st))
+        found.sort()
+        for accessed, video_id, extension, st in found:
+            self._entries[video_id] = Entry(st.st_size, st.st_mtime, accessed, extension)
+            self._bytes += st.st_size
+        victims = []
+        while self._bytes > self.max_bytes and self._entries:
+            victims.append(self._pop_oldest('lru'))
+        self._unlink(victims)
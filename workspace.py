@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Scratch space for PNG frames on their way into ffmpeg
+
+When frames have to exist as PNG files (the PNG fallback in video_encoder,
+the command-line generator), open_workspace() keeps them off the disk when
+it can, trying each backend in turn:
+
+* memfd: the frames concatenated in one memfd_create file, read by ffmpeg
+  through /proc/self/fd with the image2pipe demuxer (Linux only)
+* shm: a directory of numbered frames under /dev/shm (tmpfs)
+* disk: the same in the system temp directory
+
+WORKSPACE_BACKEND=memfd|shm|disk picks one (falling back if it is not
+available here). A workspace removes everything it holds on close(), when
+its `with` block exits, or failing both when it is garbage collected or the
+interpreter exits.
+
+    with open_workspace() as workspace:
+        for frame in frames:
+            workspace.add_frame(frame)
+        subprocess.run(['ffmpeg', *workspace.input_args(FRAMERATE), ..., output],
+                       pass_fds=workspace.pass_fds, check=True)
+
+    python workspace.py [frames]   # time each backend
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import weakref
+
+# Where frames go: auto (memfd, then shm, then disk), memfd, shm or disk
+WORKSPACE_BACKEND = os.environ.get('WORKSPACE_BACKEND', 'auto')
+
+# tmpfs mount for the shm backend
+SHM_DIR = '/dev/shm'
+
+BACKENDS = ('memfd', 'shm', 'disk')
+
+
+class MemfdWorkspace:
+    """Frames as one in-memory stream of concatenated PNGs"""
+
+    backend = 'memfd'
+
+    def __init__(self, prefix):
+        # Close-on-exec; pass_fds hands it to ffmpeg alone
+        fd = os.memfd_create(prefix, os.MFD_CLOEXEC)
+        self._file = os.fdopen(fd, 'wb')
+        self._finalizer = weakref.finalize(self, self._file.close)
+        self.frames = 0
+
+    @property
+    def pass_fds(self):
+        return (self._file.fileno(),)
+
+    def add_frame(self, image):
+        image.save(self._file, format='PNG')
+        self.frames += 1
+
+    def add_png(self, data):
+        self._file.write(data)
+        self.frames += 1
+
+    def input_args(self, framerate):
+        """ffmpeg input options reading every frame added so far"""
+        self._file.flush()
+        # Opening /proc/self/fd/N gives ffmpeg its own offset, from the start
+        return ['-f', 'image2pipe', '-framerate', framerate,
+                '-i', f'/proc/self/fd/{self._file.fileno()}']
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class DirectoryWorkspace:
+    """Frames as numbered PNG files in a private temporary directory"""
+
+    pass_fds = ()
+
+    def __init__(self, prefix, root=None):
+        self.backend = 'disk' if root is None else 'shm'
+        self.directory = tempfile.mkdtemp(prefix=prefix, dir=root)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+        self.frames = 0
+
+    def _next_path(self):
+        path = os.path.join(self.directory, f"frame_{self.frames:03d}.png")
+        self.frames += 1
+        return path
+
+    def add_frame(self, image):
+        image.save(self._next_path())
+
+    def add_png(self, data):
+        with open(self._next_path(), 'wb') as f:
+            f.write(data)
+
+    def input_args(self, framerate):
+        """ffmpeg input options reading every frame added so far"""
+        return ['-framerate', framerate, '-i', os.path.join(self.directory, 'frame_%03d.png')]
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def open_workspace(prefix='password_frames_', backend=WORKSPACE_BACKEND):
+    """A new, empty workspace on the first backend that works here"""
+    if backend not in BACKENDS:
+        backend = 'memfd'  # auto, or unknown: try them all
+    for name in BACKENDS[BACKENDS.index(backend):]:
+        try:
+            if name == 'memfd':
+                if os.path.isdir('/proc/self/fd'):
+                    return MemfdWorkspace(prefix)
+            elif name == 'shm':
+                if os.access(SHM_DIR, os.W_OK):
+                    return DirectoryWorkspace(prefix, SHM_DIR)
+            else:
+                return DirectoryWorkspace(prefix)
+        except (AttributeError, OSError):
+            continue  # no memfd_create on this platform, or not allowed
+    raise OSError('No workspace backend is available')
+
+
+def main():
+    import subprocess
+    from frame_atlas import FrameAtlas, template_lines
+    from plan import new_plan
+    from video_encoder import ENCODE_ARGS, FRAMERATE
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    atlas = FrameAtlas().preload(template_lines())
+    plans = [new_plan().steps() for _ in range(count)]
+    output = os.path.join(tempfile.gettempdir(), f'bench_workspace_{os.getpid()}.mp4')
+    try:
+        print(f"{count} videos; per video: frames saved, then encoded")
+        for backend in BACKENDS:
+            saving = encoding = 0.0
+            for texts in plans:
+                with open_workspace(backend=backend) as workspace:
+                    start = time.perf_counter()
+                    for text in texts:
+                        workspace.add_frame(atlas.render(text))
+                    saving += time.perf_counter() - start
+                    start = time.perf_counter()
+                    cmd = ['ffmpeg', '-y', '-loglevel', 'error'] + workspace.input_args(FRAMERATE) + \
+                        ENCODE_ARGS + ['-f', 'mp4', output]
+                    subprocess.run(cmd, check=True, pass_fds=workspace.pass_fds)
+                    encoding += time.perf_counter() - start
+            print(f"{workspace.backend:<6} save {saving / count * 1000:7.1f} ms   "
+                  f"encode {encoding / count * 1000:7.1f} ms")
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+
+
+if __name__ == "__main__":
+    main()